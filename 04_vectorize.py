@@ -2,40 +2,51 @@
 from pathlib import Path
 import numpy as np
 import faiss
-from openai import OpenAI
 from dotenv import load_dotenv
 import json
+from embeddings import OpenAIEmbeddingProvider, LocalEmbeddingProvider
+from lexical_index import LEXICAL_DIR, SparseBM25, tokenize
+from snapshot import SNAPSHOT_ROOT, write_snapshot
+from vector_index import build_index, storage_spec, truncate, write_manifest, INDEX_FILE, VECTORS_FILE
 
 load_dotenv()
-client = OpenAI()
 
 chunk_size = 600
 chunk_overlap = 120
-embeddings_type = "small" # "large" or "small"
+embedding_provider = "openai" # "openai" (API) or "local" (sentence-transformers on CPU)
+embeddings_type = "small" # "large" or "small" (OpenAI)
+local_model = "intfloat/multilingual-e5-small" # used when embedding_provider = "local"
+local_backend = "torch" # or "onnx" (optional: pip install onnxruntime optimum)
+embedding_dimensions = None # e.g. 1024: shortened embeddings via the API "dimensions" parameter
+search_dim = None # e.g. 256: first-stage search over truncated vectors, rescored at full dimension
+
+# FAISS index-factory spec, e.g. "Flat" (exact), "HNSW32", "IVF1024,Flat", "IVF1024,PQ64"
+index_spec = "Flat"
+search_params = "" # e.g. "nprobe=16" for IVF, "efSearch=64" for HNSW
+train_size = 50000 # max vectors used to train IVF/PQ indexes
+
+# Stored vector codec: "float32", "float16" (2x smaller), "int8" (4x) or "pq" (16x).
+# Compressed indexes over-fetch rescore_factor * k candidates and rescore them
+# exactly against the full-precision vectors in db_vectors.npy (memory-mapped).
+storage = "float32"
+rescore_factor = 4
 
 
 # Directories
 chunk_dir = Path(f"data/03_chunked/c{chunk_size}_{chunk_overlap}")
-vector_dir = Path(f"data/05_vectorized/{embeddings_type}/c{chunk_size}_{chunk_overlap}")
+vector_dir = Path(f"data/05_vectorized/{embeddings_type if embedding_provider == 'openai' else 'local'}/c{chunk_size}_{chunk_overlap}")
 vector_dir.mkdir(parents=True, exist_ok=True)
 
 # ---------- Embedding ----------
-def embedding(text: str) -> np.ndarray:
-    response = client.embeddings.create(
-        model=f"text-embedding-3-{embeddings_type}",
-        input=text
-    )
-    return np.array(response.data[0].embedding, dtype=np.float32)
+if embedding_provider == "openai":
+    provider = OpenAIEmbeddingProvider(model=f"text-embedding-3-{embeddings_type}", dimensions=embedding_dimensions)
+else:
+    provider = LocalEmbeddingProvider(model=local_model, backend=local_backend)
 
 # ---------- FAISS DB ----------
 def build_db(chunk_dir: Path):
     metadata = []
-    index = None
-
-    dim = 1536 if embeddings_type == "small" else 3072 # 3072 for text-embedding-3-large, 1536 for small
-
-    index = faiss.IndexFlatIP(dim) 
-    print(f"[INFO] FAISS index initialized with dim={dim}")
+    texts = []
 
     for json_path in chunk_dir.glob("*.json"):
         source_file = json_path.stem
@@ -46,10 +57,7 @@ def build_db(chunk_dir: Path):
         for chunk in chunks:
             #combined_text = " ".join(chunk.get("topics", []) + [chunk.get("summary", ""), chunk["content"]])
             combined_text = chunk["content"]
-            vec = embedding(combined_text)
-            vec = vec / np.linalg.norm(vec)
-
-            index.add(vec.reshape(1, -1))
+            texts.append(combined_text)
 
             metadata.append({
                 "source_file": source_file,
@@ -59,15 +67,24 @@ def build_db(chunk_dir: Path):
                 "content": chunk["content"],
               #  "summary": chunk.get("summary", ""),
               #  "topics": chunk.get("topics", []),
-                "chunk_vector": vec.tolist()
             })
 
-    return index, metadata
+    # Batched embedding, L2-normalized by the provider
+    print(f"[INFO] Embedding {len(texts)} chunks with {provider.name} provider")
+    vectors = provider.embed_documents(texts)
+    dim = vectors.shape[1]
+
+    index_dim = search_dim or dim
+    spec = storage_spec(index_spec, storage, index_dim)
+    index = build_index(truncate(vectors, index_dim), spec=spec, train_size=train_size)
+    print(f"[INFO] FAISS index '{spec}' built with dim={index_dim} (embedding dim={dim}), ntotal={index.ntotal}")
+
+    return index, metadata, vectors
 
 # ---------- Run ----------
-index, metadata = build_db(chunk_dir)
+index, metadata, vectors = build_db(chunk_dir)
 
-faiss_index_path = vector_dir / "db.index"
+faiss_index_path = vector_dir / INDEX_FILE
 metadata_path = vector_dir / "db.json"
 
 faiss.write_index(index, str(faiss_index_path))
@@ -75,4 +92,27 @@ faiss.write_index(index, str(faiss_index_path))
 with open(metadata_path, "w", encoding="utf-8") as f:
     json.dump(metadata, f, ensure_ascii=False, indent=2)
 
-print("\n[OK] FAISS index and metadata saved")
+# Full-precision vectors, kept out of db.json and memory-mapped at query time
+np.save(vector_dir / VECTORS_FILE, vectors)
+
+# Lexical index (same tokenize rules as the chatbot), memory-mapped at startup
+bm25 = SparseBM25([tokenize(m["content"]) for m in metadata])
+bm25.save(vector_dir / LEXICAL_DIR)
+
+manifest_fields = dict(
+    index_spec=storage_spec(index_spec, storage, index.d),
+    search_params=search_params,
+    storage=storage,
+    rescore_factor=rescore_factor if storage != "float32" or index.d < vectors.shape[1] else 1,
+    dim=int(vectors.shape[1]),
+    search_dim=index.d,
+    ntotal=index.ntotal,
+    **provider.manifest_fields()
+)
+write_manifest(vector_dir, **manifest_fields)
+
+print("\n[OK] FAISS index, BM25 index and metadata saved")
+
+# Same build as a versioned snapshot (compact chunk store, memory-mapped by the web app),
+# made current so the next server start serves it
+write_snapshot(index, metadata, vectors, bm25, manifest_fields, root=SNAPSHOT_ROOT)
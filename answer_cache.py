@@ -0,0 +1,100 @@
+# Libraries
+import threading
+import time
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Answers to first-turn questions, matched by query-embedding similarity
+    so that re-worded versions of the same question skip retrieval and the
+    LLM call. Entries expire after `ttl_seconds`, the least recently used
+    entry is evicted beyond `max_entries`, and the whole cache is dropped
+    when the index version changes (answers would cite stale chunks).
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 24 * 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._vectors = None # (n, dim) normalized query embeddings
+        self._entries = [] # row-aligned with _vectors
+
+        self.hits = 0
+        self.misses = 0
+
+    def _reset(self, version):
+        self._version = version
+        self._vectors = None
+        self._entries = []
+
+    def _drop(self, rows: list[int]):
+        if rows:
+            dropped = set(rows)
+            self._vectors = np.delete(self._vectors, rows, axis=0)
+            self._entries = [e for i, e in enumerate(self._entries) if i not in dropped]
+
+    def _evict(self, now: float):
+        expired = [i for i, e in enumerate(self._entries) if now - e["created"] > self.ttl_seconds]
+        self._drop(expired)
+
+        if len(self._entries) > self.max_entries:
+            by_use = sorted(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+            self._drop(by_use[:len(self._entries) - self.max_entries])
+
+    def lookup(self, q_vec: np.ndarray, version: str, params: tuple):
+        """Cached (answer, context_chunks) for a similar question asked with the same params, or None."""
+        q = q_vec.reshape(-1) / np.linalg.norm(q_vec)
+
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+            self._evict(time.time())
+
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            sims = self._vectors @ q
+            sims[[e["params"] != params for e in self._entries]] = -1
+            best = int(np.argmax(sims))
+
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[best]
+            entry["last_used"] = time.time()
+            self.hits += 1
+            return entry["answer"], entry["context_chunks"]
+
+    def store(self, q_vec: np.ndarray, version: str, params: tuple, answer: str, context_chunks: list):
+        q = (q_vec.reshape(-1) / np.linalg.norm(q_vec)).astype(np.float32)
+        now = time.time()
+
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+
+            self._vectors = q[None, :] if self._vectors is None else np.vstack([self._vectors, q])
+            self._entries.append({
+                "params": params,
+                "answer": answer,
+                "context_chunks": context_chunks,
+                "created": now,
+                "last_used": now,
+            })
+            self._evict(now)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "version": self._version,
+        }
@@ -0,0 +1,851 @@
+# Libraries
+import argparse
+import json
+import time
+from pathlib import Path
+import numpy as np
+import faiss
+import vector_index
+from vector_index import DenseIndex, build_index, load_index, set_search_params, storage_spec, truncate
+
+
+# ---------------- Helpers ----------------
+def load_vectors(vector_dir: Path) -> np.ndarray:
+    vectors = vector_index.load_vectors(vector_dir)
+    if vectors is not None:
+        return vectors
+
+    # Older builds kept the vectors inside db.json
+    with open(Path(vector_dir) / "db.json", "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    return np.array([m["chunk_vector"] for m in metadata], dtype=np.float32)
+
+
+def make_queries(vectors: np.ndarray, n: int, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """Perturbed corpus vectors, renormalized, as stand-ins for real query embeddings."""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(n, len(vectors)), replace=False)]
+    queries = queries + rng.normal(0, noise / np.sqrt(vectors.shape[1]), queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = [len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth)]
+    return float(np.mean(hits)) / k
+
+
+def time_queries(search, queries: np.ndarray):
+    """Search one query at a time (as the chatbot does) and return latencies in ms."""
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(search(q.reshape(1, -1)))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies), results
+
+
+def index_memory_mb(index) -> float:
+    return faiss.serialize_index(index).nbytes / 1e6
+
+
+def print_table(rows: list[dict]):
+    if not rows:
+        return
+    cols = list(rows[0].keys())
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(cols, widths)))
+
+
+def load_metadata(vector_dir: Path) -> list[dict]:
+    with open(Path(vector_dir) / "db.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_eval_questions(path: Path, limit: int | None = None) -> list[dict]:
+    from utils import json_to_documents
+
+    with open(path, "r", encoding="utf-8") as f:
+        samples = json_to_documents(json.load(f))
+    return samples[:limit] if limit else samples
+
+
+def source_hit(chunks: list[dict], source: str) -> bool:
+    source = source.lower()
+    return any(c["source_file"].lower() in source or source in c["source_file"].lower() for c in chunks)
+
+
+def load_benchmark_data(args):
+    vectors = load_vectors(args.vector_dir)
+    queries = np.load(args.queries) if args.queries else make_queries(np.asarray(vectors), args.n_queries)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    print(f"[INFO] {len(vectors)} vectors, dim={vectors.shape[1]}, {len(queries)} queries")
+
+    flat = build_index(np.asarray(vectors), "Flat")
+    return vectors, queries, flat
+
+
+# ---------------- ANN ----------------
+def bench_ann(args):
+    faiss.omp_set_num_threads(args.threads)
+
+    vectors, queries, flat = load_benchmark_data(args)
+    _, truth = flat.search(queries, args.k)
+
+    rows = []
+    for spec in args.specs:
+        start = time.perf_counter()
+        index = build_index(vectors, spec, train_size=args.train_size)
+        build_s = time.perf_counter() - start
+
+        for params in args.params:
+            try:
+                set_search_params(index, params)
+            except RuntimeError:
+                continue # parameter does not apply to this index type
+
+            latencies, results = time_queries(lambda q: index.search(q, args.k)[1], queries)
+            found = np.vstack(results)
+
+            rows.append({
+                "spec": spec,
+                "params": params or "-",
+                f"recall@{args.k}": f"{recall_at_k(found, truth):.3f}",
+                "p50_ms": f"{np.percentile(latencies, 50):.3f}",
+                "p99_ms": f"{np.percentile(latencies, 99):.3f}",
+                "memory_mb": f"{index_memory_mb(index):.1f}",
+                "build_s": f"{build_s:.1f}",
+            })
+
+    print_table(rows)
+
+
+# ---------------- Quantized storage ----------------
+def bench_quant(args):
+    faiss.omp_set_num_threads(args.threads)
+
+    vectors, queries, flat = load_benchmark_data(args)
+    _, truth = flat.search(queries, args.top_k)
+    flat_mb = index_memory_mb(flat)
+
+    rows = []
+    index_dim = args.search_dim or vectors.shape[1]
+
+    for storage in args.storage:
+        spec = storage_spec(args.spec, storage, index_dim, args.pq_m)
+        index = build_index(truncate(vectors, index_dim), spec, train_size=args.train_size)
+        set_search_params(index, args.params)
+        memory_mb = index_memory_mb(index)
+
+        for factor in args.rescore_factors:
+            dense = DenseIndex(index, {"rescore_factor": factor}, vectors)
+            latencies, results = time_queries(lambda q: dense.search(q, args.top_k)[1], queries)
+            recall = recall_at_k(np.vstack(results), truth)
+
+            rows.append({
+                "storage": storage,
+                "spec": spec,
+                "dim": index_dim,
+                "rescore": f"x{factor}" if factor > 1 else "-",
+                f"recall@{args.top_k}": f"{recall:.3f}",
+                "within_tol": "yes" if recall >= 1 - args.tolerance else "no",
+                "p50_ms": f"{np.percentile(latencies, 50):.3f}",
+                "p99_ms": f"{np.percentile(latencies, 99):.3f}",
+                "memory_mb": f"{memory_mb:.1f}",
+                "shrink": f"{flat_mb / memory_mb:.1f}x",
+            })
+
+    print(f"[INFO] Tolerance: recall@{args.top_k} >= {1 - args.tolerance:.3f} of exact float32 search")
+    print_table(rows)
+
+
+# ---------------- Embedding backends ----------------
+def bench_embed(args):
+    from embeddings import get_provider
+
+    samples = load_eval_questions(args.dataset, args.n_queries)
+    print(f"[INFO] {len(samples)} evaluation questions")
+
+    rows = []
+    reference = None
+    for vector_dir in args.vector_dirs:
+        index = load_index(vector_dir)
+        metadata = load_metadata(vector_dir)
+        provider = get_provider(index.manifest, threads=args.threads)
+        provider.embed_query("aquecimento") # warm-up (model load / connection)
+
+        latencies, retrieved = [], []
+        for sample in samples:
+            start = time.perf_counter()
+            q_vec = provider.embed_query(sample["question"])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            _, I = index.search(q_vec, args.k)
+            retrieved.append([metadata[i] for i in I[0] if i >= 0])
+
+        keys = [{(c["url"], c["chunk_id"]) for c in chunks} for chunks in retrieved]
+        if reference is None:
+            reference = keys
+        overlap = np.mean([len(a & b) / args.k for a, b in zip(keys, reference)])
+
+        rows.append({
+            "vector_dir": str(vector_dir),
+            "provider": index.manifest.get("embedding_provider", "openai"),
+            "model": index.manifest.get("embedding_model", "text-embedding-3-small"),
+            "embed_p50_ms": f"{np.percentile(latencies, 50):.1f}",
+            "embed_p95_ms": f"{np.percentile(latencies, 95):.1f}",
+            f"source_hit@{args.k}": f"{np.mean([source_hit(r, s['source']) for r, s in zip(retrieved, samples)]):.3f}",
+            f"overlap@{args.k}_vs_first": f"{overlap:.3f}",
+        })
+
+    print_table(rows)
+
+
+# ---------------- BM25 ----------------
+def synthetic_corpus(n_docs: int, vocab_size: int, rng, mean_len: int = 90) -> list[list[str]]:
+    """Zipf-distributed tokens, ~90 tokens per document (a 600-character chunk)."""
+    ranks = np.arange(1, vocab_size + 1)
+    p = (1 / ranks) / (1 / ranks).sum()
+    vocab = np.array([f"t{i}" for i in range(vocab_size)])
+    lengths = rng.poisson(mean_len, n_docs).clip(5)
+    tokens = vocab[rng.choice(vocab_size, lengths.sum(), p=p)].tolist()
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [tokens[bounds[i]:bounds[i + 1]] for i in range(n_docs)]
+
+
+def bench_bm25(args):
+    from lexical_index import SparseBM25
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for n_docs in args.sizes:
+        corpus = synthetic_corpus(n_docs, args.vocab_size, rng)
+        queries = [corpus[i][:args.query_len] for i in rng.choice(n_docs, args.n_queries)]
+
+        start = time.perf_counter()
+        sparse = SparseBM25(corpus)
+        build_s = time.perf_counter() - start
+
+        sparse_ms = []
+        for q in queries:
+            start = time.perf_counter()
+            sparse.top_k(q, args.k)
+            sparse_ms.append((time.perf_counter() - start) * 1000)
+
+        row = {
+            "docs": n_docs,
+            "build_s": f"{build_s:.1f}",
+            "sparse_p50_ms": f"{np.percentile(sparse_ms, 50):.2f}",
+            "sparse_p99_ms": f"{np.percentile(sparse_ms, 99):.2f}",
+            "rank_bm25_p50_ms": "-",
+            "max_abs_diff": "-",
+        }
+
+        if n_docs <= args.rank_bm25_max:
+            from rank_bm25 import BM25Okapi
+
+            okapi = BM25Okapi(corpus)
+            okapi_ms, diffs = [], []
+            for q in queries[:args.rank_bm25_queries]:
+                start = time.perf_counter()
+                scores = okapi.get_scores(q)
+                okapi_ms.append((time.perf_counter() - start) * 1000)
+                diffs.append(np.abs(scores - sparse.get_scores(q)).max())
+            row["rank_bm25_p50_ms"] = f"{np.percentile(okapi_ms, 50):.2f}"
+            row["max_abs_diff"] = f"{max(diffs):.1e}"
+
+        rows.append(row)
+        print(f"[INFO] {n_docs} docs done")
+
+    print_table(rows)
+
+
+# ---------------- Reranker ----------------
+def bench_rerank(args):
+    from lexical_index import load_or_build, tokenize
+    from reranker import Reranker, load_backend
+
+    metadata = load_metadata(args.vector_dir)
+    bm25 = load_or_build(args.vector_dir, metadata)
+    samples = load_eval_questions(args.dataset, args.n_queries)
+
+    # Lexical candidates stand in for the fused list (no embedding calls needed)
+    max_k = max(args.ks)
+    candidates = [[metadata[i] for i in bm25.top_k(tokenize(s["question"]), max_k)[0]] for s in samples]
+    print(f"[INFO] {len(samples)} questions, {len(metadata)} chunks")
+
+    rows = []
+    reference = {}
+    for backend_name in args.backends:
+        backend = load_backend(backend_name, max_length=args.max_length, threads=args.threads)
+        Reranker(backend).warmup()
+
+        for k in args.ks:
+            reranker = Reranker(backend, cache_size=0 if args.no_cache else 50000)
+            cold_ms, warm_ms, tops = [], [], []
+            for s, chunks in zip(samples, candidates):
+                start = time.perf_counter()
+                top = reranker.rerank(s["question"], chunks[:k], top_k=args.top_k)
+                cold_ms.append((time.perf_counter() - start) * 1000)
+                tops.append({(c["url"], c["chunk_id"]) for c in top})
+
+                # Same question again, e.g. a retry or a popular question
+                start = time.perf_counter()
+                reranker.rerank(s["question"], chunks[:k], top_k=args.top_k)
+                warm_ms.append((time.perf_counter() - start) * 1000)
+
+            reference.setdefault(k, tops)
+            overlap = np.mean([len(a & b) / args.top_k for a, b in zip(tops, reference[k])])
+            rows.append({
+                "backend": backend.name,
+                "k": k,
+                "p50_ms": f"{np.percentile(cold_ms, 50):.1f}",
+                "p95_ms": f"{np.percentile(cold_ms, 95):.1f}",
+                "cached_p50_ms": f"{np.percentile(warm_ms, 50):.2f}",
+                f"top{args.top_k}_overlap_vs_first": f"{overlap:.3f}",
+            })
+
+    print_table(rows)
+
+
+# ---------------- Cascade reranking ----------------
+def bench_cascade(args):
+    from lexical_index import load_or_build, tokenize
+    from reranker import Reranker, load_backend
+
+    metadata = load_metadata(args.vector_dir)
+    bm25 = load_or_build(args.vector_dir, metadata)
+    samples = load_eval_questions(args.dataset, args.n_queries)
+
+    # BM25 scores stand in for the hybrid scores as the cascade prior
+    lists = [bm25.top_k(tokenize(s["question"]), args.k) for s in samples]
+    candidates = [[metadata[i] for i in ids] for ids, _ in lists]
+    print(f"[INFO] {len(samples)} questions, k={args.k}, top_k={args.top_k}")
+
+    backend = load_backend(args.backend, max_length=args.max_length, threads=args.threads)
+    Reranker(backend).warmup()
+
+    def run(rerank):
+        latencies, depths, tops = [], [], []
+        for s, chunks, (_, prior) in zip(samples, candidates, lists):
+            start = time.perf_counter()
+            top, depth = rerank(Reranker(backend, cache_size=0), s["question"], chunks, prior)
+            latencies.append((time.perf_counter() - start) * 1000)
+            depths.append(depth)
+            tops.append({(c["url"], c["chunk_id"]) for c in top})
+        return np.array(latencies), np.array(depths), tops
+
+    full_ms, full_depth, full_tops = run(lambda r, q, c, p: (r.rerank(q, c, args.top_k), len(c)))
+    rows = [{
+        "mode": "full",
+        "p50_ms": f"{np.percentile(full_ms, 50):.1f}",
+        "p95_ms": f"{np.percentile(full_ms, 95):.1f}",
+        "mean_depth": f"{full_depth.mean():.1f}",
+        "skipped": "0.000",
+        f"top{args.top_k}_overlap_vs_full": "1.000",
+    }]
+
+    for min_gap in args.min_gaps:
+        ms, depth, tops = run(lambda r, q, c, p: r.cascade(q, c, p, args.top_k, min_gap, args.batch_size))
+        overlap = np.mean([len(a & b) / args.top_k for a, b in zip(tops, full_tops)])
+        rows.append({
+            "mode": f"cascade gap={min_gap}",
+            "p50_ms": f"{np.percentile(ms, 50):.1f}",
+            "p95_ms": f"{np.percentile(ms, 95):.1f}",
+            "mean_depth": f"{depth.mean():.1f}",
+            "skipped": f"{np.mean(depth == 0):.3f}",
+            f"top{args.top_k}_overlap_vs_full": f"{overlap:.3f}",
+        })
+
+    print_table(rows)
+
+
+# ---------------- UI streaming ----------------
+def fake_answer_stream(n_chars: int, chars_per_token: int, token_ms: float, rng):
+    """Token deltas at a model-like pace, ~chars_per_token characters each."""
+    text = "x" * n_chars
+    for i in range(0, n_chars, chars_per_token):
+        time.sleep(rng.exponential(token_ms) / 1000)
+        yield text[i:i + chars_per_token]
+    return text, []
+
+
+def bench_ui(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from streaming import coalesce
+
+    def per_char(stream):
+        # Previous behaviour: the finished answer replayed one character at a time
+        while True:
+            try:
+                next(stream)
+            except StopIteration as done:
+                text, _ = done.value
+                break
+        yield from text
+
+    modes = {
+        "per-char replay": per_char,
+        "per-token": lambda stream: stream,
+        **{f"every {ms:g} ms": (lambda ms: lambda stream: coalesce(stream, interval_ms=ms))(ms) for ms in args.intervals},
+        **{f"every {n} tokens": (lambda n: lambda stream: coalesce(stream, interval_ms=float("inf"), max_deltas=n))(n)
+           for n in args.token_batches},
+    }
+
+    def session(mode, seed):
+        # What Gradio does per yield: diff and serialize the whole chat history
+        rng = np.random.default_rng(seed)
+        history = [{"role": "user", "content": "pergunta"}, {"role": "assistant", "content": ""}]
+        messages = 0
+        for delta in modes[mode](fake_answer_stream(args.answer_chars, args.chars_per_token, args.token_ms, rng)):
+            history[-1]["content"] += delta
+            json.dumps(history)
+            messages += 1
+        return messages
+
+    rows = []
+    for mode in modes:
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            messages = list(pool.map(lambda seed: session(mode, seed), range(args.sessions)))
+        cpu_s, wall_s = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+        rows.append({
+            "mode": mode,
+            "sessions": args.sessions,
+            "messages_per_answer": f"{np.mean(messages):.0f}",
+            "cpu_s": f"{cpu_s:.2f}",
+            "cpu_ms_per_answer": f"{cpu_s * 1000 / args.sessions:.1f}",
+            "wall_s": f"{wall_s:.1f}",
+        })
+
+    print_table(rows)
+
+
+# ---------------- Concurrent load ----------------
+def bench_load(args):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import chatbot
+
+    index, metadata = chatbot.load_faiss_index(args.vector_dir)
+    bm25 = chatbot.load_bm25(args.vector_dir, metadata)
+    questions = [s["question"] for s in load_eval_questions(args.dataset)]
+    print(f"[INFO] LLM at {chatbot.async_client.base_url} (start stub_llm.py and set OPENAI_BASE_URL for a local stub)")
+
+    def summarize(mode, concurrency, wall_s, timings):
+        # Time to first token as the user sees it, including waiting for a free worker
+        ttft = [t["queued_ms"] + t["ttft_ms"] for t in timings]
+        return {
+            "mode": mode,
+            "concurrent": concurrency,
+            "answers_per_s": f"{len(timings) / wall_s:.1f}",
+            "ttft_p50_ms": f"{np.percentile(ttft, 50):.0f}",
+            "ttft_p95_ms": f"{np.percentile(ttft, 95):.0f}",
+            "total_p95_ms": f"{np.percentile([t['queued_ms'] + t['total_ms'] for t in timings], 95):.0f}",
+            "cached_prompt_share": f"{sum(t.get('cached_tokens', 0) for t in timings) / max(1, sum(t.get('prompt_tokens', 0) for t in timings)):.2f}",
+        }
+
+    async def one_async(question, timings, load_start):
+        timings["queued_ms"] = (time.perf_counter() - load_start) * 1000
+        async for _ in chatbot.answer_stream_async(question, index, metadata, bm25, timings=timings):
+            pass
+
+    async def run_async():
+        # One event loop for every level: the async client's connections belong to it
+        results = {}
+        for n in args.concurrency:
+            timings = [{} for _ in range(n)]
+            start = time.perf_counter()
+            await asyncio.gather(*(one_async(questions[i % len(questions)], t, start) for i, t in enumerate(timings)))
+            results[n] = (time.perf_counter() - start, timings)
+        return results
+
+    def one_sync(question, timings, load_start):
+        timings["queued_ms"] = (time.perf_counter() - load_start) * 1000
+        for _ in chatbot.answer_stream(question, index, metadata, bm25, timings=timings):
+            pass
+        return timings
+
+    async_results = asyncio.run(run_async())
+
+    rows = []
+    for n in args.concurrency:
+        wall_s, timings = async_results[n]
+        rows.append(summarize("async", n, wall_s, timings))
+
+        # Same load through a fixed pool of worker threads, as a sync Gradio handler
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sync_threads) as pool:
+            timings = list(pool.map(lambda i: one_sync(questions[i % len(questions)], {}, start), range(n)))
+        rows.append(summarize(f"sync ({args.sync_threads} threads)", n, time.perf_counter() - start, timings))
+        print(f"[INFO] {n} concurrent conversations done")
+
+    print_table(rows)
+
+
+# ---------------- Context assembly ----------------
+def bench_context(args):
+    from context_builder import build_context, count_tokens
+    from lexical_index import load_or_build, tokenize
+
+    metadata = load_metadata(args.vector_dir)
+    bm25 = load_or_build(args.vector_dir, metadata)
+    samples = load_eval_questions(args.dataset, args.n_queries)
+
+    rows = []
+    for top_k in args.top_ks:
+        raw, merged, packed, hits_raw, hits_packed = [], [], [], [], []
+        for s in samples:
+            chunks = [metadata[i] for i in bm25.top_k(tokenize(s["question"]), top_k)[0]]
+            raw.append(sum(count_tokens(c["content"]) for c in chunks))
+            merged.append(sum(count_tokens(b["content"]) for b in build_context(chunks, None)))
+            blocks = build_context(chunks, args.budget)
+            packed.append(sum(count_tokens(b["content"]) for b in blocks))
+            hits_raw.append(source_hit(chunks, s["source"]))
+            hits_packed.append(source_hit(blocks, s["source"]))
+
+        rows.append({
+            "top_k": top_k,
+            "raw_tokens": f"{np.mean(raw):.0f}",
+            "merged_tokens": f"{np.mean(merged):.0f}",
+            f"packed_{args.budget}_tokens": f"{np.mean(packed):.0f}",
+            "source_hit_raw": f"{np.mean(hits_raw):.3f}",
+            "source_hit_packed": f"{np.mean(hits_packed):.3f}",
+        })
+
+    print_table(rows)
+
+
+# ---------------- Context compression ----------------
+def bench_compress(args):
+    from compression import compress_chunks
+    from context_builder import build_context, count_tokens
+    from lexical_index import load_or_build, tokenize
+
+    metadata = load_metadata(args.vector_dir)
+    bm25 = load_or_build(args.vector_dir, metadata)
+    samples = load_eval_questions(args.dataset, args.n_queries)
+    candidates = [[metadata[i] for i in bm25.top_k(tokenize(s["question"]), args.top_k)[0]] for s in samples]
+
+    reranker = None
+    if "cross-encoder" in args.methods:
+        from reranker import Reranker, load_backend
+        reranker = Reranker(load_backend(args.backend))
+
+    def answer_recall(blocks, reference):
+        # Share of the reference answer's terms still present in the context (evidence kept)
+        ref = set(tokenize(reference))
+        ctx = set(t for b in blocks for t in tokenize(b["content"]))
+        return len(ref & ctx) / len(ref) if ref else 1.0
+
+    rows = []
+    for method in ["none", *args.methods]:
+        tokens, recall, hits, latencies = [], [], [], []
+        for s, chunks in zip(samples, candidates):
+            start = time.perf_counter()
+            if method != "none":
+                chunks = compress_chunks(s["question"], chunks, method=method, bm25=bm25, reranker=reranker,
+                                         keep_ratio=args.keep_ratio)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            blocks = build_context(chunks, args.budget)
+            tokens.append(sum(count_tokens(b["content"]) for b in blocks))
+            recall.append(answer_recall(blocks, s["answer"]))
+            hits.append(source_hit(blocks, s["source"]))
+
+        rows.append({
+            "method": method,
+            "context_tokens": f"{np.mean(tokens):.0f}",
+            "answer_term_recall": f"{np.mean(recall):.3f}",
+            "source_hit": f"{np.mean(hits):.3f}",
+            "compress_p50_ms": f"{np.percentile(latencies, 50):.1f}",
+        })
+
+    print_table(rows)
+    print("[INFO] Answer quality: run evaluation.py with compress set to compare RAGAS scores")
+
+
+# ---------------- Startup ----------------
+STARTUP_SCRIPTS = {
+    # What gradio_website does before demo.launch(), per loading path
+    "vector_dir": """
+import chatbot
+from source_filter import build_source_map
+loaded = time.perf_counter()
+index, metadata = chatbot.load_faiss_index(Path(path))
+bm25 = chatbot.load_bm25(Path(path), metadata)
+source_map = build_source_map(metadata)
+""",
+    "snapshot": """
+import chatbot
+from snapshot import load_snapshot
+loaded = time.perf_counter()
+snapshot = load_snapshot(Path(path))
+index, metadata, bm25 = snapshot.index, snapshot.chunks, snapshot.bm25
+""",
+}
+
+STARTUP_HARNESS = """
+import json, resource, sys, time
+from pathlib import Path
+start = time.perf_counter()
+path = sys.argv[1]
+{script}
+ready = time.perf_counter()
+from lexical_index import tokenize
+bm25.get_scores(tokenize("apoio a empresas"))
+[metadata[i] for i in range(0, len(metadata), max(1, len(metadata) // 20))]
+print(json.dumps({{"import_s": loaded - start, "load_s": ready - loaded, "first_query_ms": (time.perf_counter() - ready) * 1000,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+def bench_startup(args):
+    import subprocess
+    import sys
+
+    paths = {"vector_dir": args.vector_dir, "snapshot": args.snapshot_root}
+    rows = []
+    for mode, script in STARTUP_SCRIPTS.items():
+        runs = []
+        for _ in range(args.repeats):
+            # A fresh interpreter per run: imports and loading are what is measured
+            out = subprocess.run([sys.executable, "-c", STARTUP_HARNESS.format(script=script), str(paths[mode])],
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                print(f"[WARN] {mode}: {out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'failed'}")
+                break
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        if not runs:
+            continue
+
+        rows.append({
+            "load": mode,
+            "import_s": f"{np.median([r['import_s'] for r in runs]):.2f}",
+            "load_s": f"{np.median([r['load_s'] for r in runs]):.2f}",
+            "ready_s": f"{np.median([r['import_s'] + r['load_s'] for r in runs]):.2f}",
+            "first_query_ms": f"{np.median([r['first_query_ms'] for r in runs]):.1f}",
+            "peak_rss_mb": f"{np.median([r['rss_mb'] for r in runs]):.0f}",
+        })
+
+    print_table(rows)
+    print("[INFO] Warm page cache; drop it (echo 3 > /proc/sys/vm/drop_caches) for cold-disk numbers")
+
+
+# ---------------- Workers ----------------
+def bench_workers(args):
+    import multiprocessing
+    import os
+    import sys
+    from lexical_index import load_or_build, tokenize
+    from serve import memory_usage
+    from snapshot import load_snapshot
+
+    def load(mode):
+        if mode == "snapshot":
+            snapshot = load_snapshot(args.snapshot_root)
+            return snapshot.index, snapshot.chunks, snapshot.bm25
+        # What each process holds privately when it loads the vectorized folder itself
+        metadata = load_metadata(args.vector_dir)
+        return load_index(args.vector_dir), metadata, load_or_build(args.vector_dir, metadata, mmap=False)
+
+    def build_queries(mode, results):
+        # Perturbed corpus vectors and the first words of the same chunks
+        index, chunks, _ = load(mode)
+        sample = np.sort(np.random.default_rng(0).choice(index.ntotal, args.n_queries, replace=False))
+        if index.vectors is not None:
+            vectors = np.asarray(index.vectors[sample])
+        else:
+            # Older folders have no db_vectors.npy: decode the sample from the index
+            try:
+                vectors = index.index.reconstruct_batch(sample)
+            except RuntimeError as e: # e.g. IVF without a direct map
+                results.put(f"{mode}: no {vector_index.VECTORS_FILE} and the index cannot reconstruct vectors "
+                            f"({str(e).splitlines()[0]}); re-run 04_vectorize or snapshot.py build")
+                return
+        q_vecs = make_queries(vectors, args.n_queries)
+        results.put([(q, tokenize(chunks[int(i)]["content"])[:8]) for q, i in zip(q_vecs, sample)])
+
+    def worker(mode, state, queries, barrier, results):
+        index, chunks, bm25 = state if state is not None else load(mode)
+        faiss.omp_set_num_threads(1)
+        barrier.wait()
+        start = time.perf_counter()
+        for q_vec, tokens in queries:
+            _, I = index.search(q_vec.reshape(1, -1), args.k)
+            bm25.get_scores(tokens)
+            [chunks[int(i)] for i in I[0][:5]]
+        results.put({"seconds": time.perf_counter() - start, **memory_usage(os.getpid())})
+
+    # Fork only: the snapshot is preloaded once and inherited. The parent never
+    # searches, as OpenMP threads started before fork can hang the children
+    ctx = multiprocessing.get_context("fork")
+    rows = []
+    for mode in args.modes:
+        # Built in a child, so the parent holds no private copy the workers would inherit
+        results = ctx.Queue()
+        helper = ctx.Process(target=build_queries, args=(mode, results))
+        helper.start()
+        queries = results.get()
+        helper.join()
+        if isinstance(queries, str):
+            sys.exit(f"[ERROR] {queries}")
+
+        # Preload then fork for the snapshot; private copies are loaded by each worker
+        state = load(mode) if mode == "snapshot" else None
+
+        for n in args.workers:
+            barrier, results = ctx.Barrier(n), ctx.Queue()
+            processes = [ctx.Process(target=worker, args=(mode, state, queries, barrier, results)) for _ in range(n)]
+            for p in processes:
+                p.start()
+            stats = [results.get() for _ in processes]
+            for p in processes:
+                p.join()
+
+            rows.append({
+                "load": mode,
+                "workers": n,
+                "queries_per_s": f"{n * len(queries) / max(s['seconds'] for s in stats):.0f}",
+                "rss_mb_per_worker": f"{np.mean([s['rss_mb'] for s in stats]):.0f}",
+                "pss_mb_total": f"{sum(s['pss_mb'] for s in stats):.0f}",
+            })
+            print(f"[INFO] {mode}: {n} workers done")
+
+    print_table(rows)
+    print("[INFO] PSS counts shared pages once across the workers: its growth per worker is the real cost")
+
+
+# ---------------- Entry Point ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval performance benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ann = sub.add_parser("ann", help="Recall@k vs exact search, latency and memory for FAISS index specs")
+    ann.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c600_120"))
+    ann.add_argument("--specs", nargs="+", default=["Flat", "HNSW32", "IVF256,Flat", "IVF256,PQ64"])
+    ann.add_argument("--params", nargs="+", default=[""],
+                     help='Search parameters to sweep, e.g. "" nprobe=8 nprobe=32 efSearch=64')
+    ann.add_argument("--queries", type=Path, help="Optional .npy file with real query embeddings")
+    ann.add_argument("--n-queries", type=int, default=500)
+    ann.add_argument("--k", type=int, default=20)
+    ann.add_argument("--train-size", type=int, default=50000)
+    ann.add_argument("--threads", type=int, default=1)
+    ann.set_defaults(func=bench_ann)
+
+    quant = sub.add_parser("quant", help="Memory and recall@top_k of float16/int8/PQ storage with exact rescoring")
+    quant.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c600_120"))
+    quant.add_argument("--spec", default="Flat", help='Base index spec, e.g. "Flat", "HNSW32", "IVF1024,Flat"')
+    quant.add_argument("--params", default="", help='Search parameters, e.g. "nprobe=16"')
+    quant.add_argument("--storage", nargs="+", default=["float32", "float16", "int8", "pq"])
+    quant.add_argument("--pq-m", type=int, help="PQ sub-quantizers (default: dim / 4)")
+    quant.add_argument("--search-dim", type=int, help="First-stage dimension (Matryoshka truncation), e.g. 256")
+    quant.add_argument("--rescore-factors", nargs="+", type=int, default=[1, 4])
+    quant.add_argument("--tolerance", type=float, default=0.02, help="Max allowed recall loss vs float32")
+    quant.add_argument("--queries", type=Path, help="Optional .npy file with real query embeddings")
+    quant.add_argument("--n-queries", type=int, default=500)
+    quant.add_argument("--top-k", type=int, default=5)
+    quant.add_argument("--train-size", type=int, default=50000)
+    quant.add_argument("--threads", type=int, default=1)
+    quant.set_defaults(func=bench_quant)
+
+    embed = sub.add_parser("embed", help="Query-embedding latency and retrieval quality per embedding backend")
+    embed.add_argument("--vector-dirs", type=Path, nargs="+",
+                       default=[Path("data/05_vectorized/small/c600_120"), Path("data/05_vectorized/local/c600_120")],
+                       help="Indexes built by 04_vectorize with different providers (first one is the reference)")
+    embed.add_argument("--dataset", type=Path, default=Path("evaluation/evaluation_dataset_v2.json"))
+    embed.add_argument("--n-queries", type=int)
+    embed.add_argument("--k", type=int, default=5)
+    embed.add_argument("--threads", type=int, default=2, help="CPU threads for local models")
+    embed.set_defaults(func=bench_embed)
+
+    bm25 = sub.add_parser("bm25", help="Per-query BM25 latency of SparseBM25 vs rank_bm25 on synthetic corpora")
+    bm25.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    bm25.add_argument("--vocab-size", type=int, default=50_000)
+    bm25.add_argument("--query-len", type=int, default=8)
+    bm25.add_argument("--n-queries", type=int, default=200)
+    bm25.add_argument("--k", type=int, default=20)
+    bm25.add_argument("--rank-bm25-max", type=int, default=100_000, help="Largest corpus also run through rank_bm25")
+    bm25.add_argument("--rank-bm25-queries", type=int, default=20)
+    bm25.set_defaults(func=bench_bm25)
+
+    rerank = sub.add_parser("rerank", help="Cross-encoder rerank latency per backend (PyTorch vs ONNX int8) and k")
+    rerank.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c600_120"))
+    rerank.add_argument("--dataset", type=Path, default=Path("evaluation/evaluation_dataset_v2.json"))
+    rerank.add_argument("--backends", nargs="+", default=["torch", "onnx"], help="First one is the reference")
+    rerank.add_argument("--ks", type=int, nargs="+", default=[20, 50, 100])
+    rerank.add_argument("--top-k", type=int, default=5)
+    rerank.add_argument("--max-length", type=int, help="Default: the model's limit (PyTorch), 256 (ONNX)")
+    rerank.add_argument("--n-queries", type=int, default=50)
+    rerank.add_argument("--threads", type=int, default=2)
+    rerank.add_argument("--no-cache", action="store_true", help="Disable the score cache (cached_p50 = cold)")
+    rerank.set_defaults(func=bench_rerank)
+
+    cascade = sub.add_parser("cascade", help="Latency (p50/p95), depth and top-k agreement of cascade vs full reranking")
+    cascade.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c600_120"))
+    cascade.add_argument("--dataset", type=Path, default=Path("evaluation/evaluation_dataset_v2.json"))
+    cascade.add_argument("--backend", default="torch", help="torch or onnx (opt-in)")
+    cascade.add_argument("--k", type=int, default=50)
+    cascade.add_argument("--top-k", type=int, default=5)
+    cascade.add_argument("--min-gaps", type=float, nargs="+", default=[0.05, 0.15, 0.3])
+    cascade.add_argument("--batch-size", type=int, default=10)
+    cascade.add_argument("--max-length", type=int, help="Default: the model's limit (PyTorch), 256 (ONNX)")
+    cascade.add_argument("--n-queries", type=int, default=100)
+    cascade.add_argument("--threads", type=int, default=2)
+    cascade.set_defaults(func=bench_cascade)
+
+    ui = sub.add_parser("ui", help="Server CPU and UI messages per answer for N concurrent streaming sessions")
+    ui.add_argument("--sessions", type=int, default=50)
+    ui.add_argument("--answer-chars", type=int, default=1500)
+    ui.add_argument("--chars-per-token", type=int, default=4)
+    ui.add_argument("--token-ms", type=float, default=15, help="Mean time between tokens")
+    ui.add_argument("--intervals", type=float, nargs="+", default=[30, 50], help="Time-based coalescing (ms)")
+    ui.add_argument("--token-batches", type=int, nargs="+", default=[8], help="Count-based coalescing (tokens)")
+    ui.set_defaults(func=bench_ui)
+
+    load = sub.add_parser("load", help="Concurrent conversations through the async vs sync answer path")
+    load.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c400_0"))
+    load.add_argument("--dataset", type=Path, default=Path("evaluation/evaluation_dataset_v2.json"))
+    load.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 500])
+    load.add_argument("--sync-threads", type=int, default=40, help="Worker threads of the sync baseline")
+    load.set_defaults(func=bench_load)
+
+    context = sub.add_parser("context", help="Prompt context tokens of raw vs merged and budget-packed chunks")
+    context.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c600_120"))
+    context.add_argument("--dataset", type=Path, default=Path("evaluation/evaluation_dataset_v2.json"))
+    context.add_argument("--top-ks", type=int, nargs="+", default=[5, 15])
+    context.add_argument("--budget", type=int, default=3000)
+    context.add_argument("--n-queries", type=int)
+    context.set_defaults(func=bench_context)
+
+    compress = sub.add_parser("compress", help="Prompt context tokens and evidence kept by extractive compression")
+    compress.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c600_120"))
+    compress.add_argument("--dataset", type=Path, default=Path("evaluation/evaluation_dataset_v2.json"))
+    compress.add_argument("--methods", nargs="+", default=["lexical", "cross-encoder"])
+    compress.add_argument("--keep-ratio", type=float, default=0.4)
+    compress.add_argument("--top-k", type=int, default=15)
+    compress.add_argument("--budget", type=int, default=3000)
+    compress.add_argument("--backend", default="torch", help="Reranker backend for cross-encoder scoring (torch or onnx)")
+    compress.add_argument("--n-queries", type=int)
+    compress.set_defaults(func=bench_compress)
+
+    startup = sub.add_parser("startup", help="Time to ready and peak RSS: vectorized folder vs memory-mapped snapshot")
+    startup.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c400_0"))
+    startup.add_argument("--snapshot-root", type=Path, default=Path("snapshots"))
+    startup.add_argument("--repeats", type=int, default=3)
+    startup.set_defaults(func=bench_startup)
+
+    workers = sub.add_parser("workers", help="Retrieval throughput and memory per worker: memory-mapped snapshot vs private copies")
+    workers.add_argument("--vector-dir", type=Path, default=Path("data/05_vectorized/small/c400_0"))
+    workers.add_argument("--snapshot-root", type=Path, default=Path("snapshots"))
+    workers.add_argument("--modes", nargs="+", default=["vector_dir", "snapshot"])
+    workers.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    workers.add_argument("--n-queries", type=int, default=200, help="Queries per worker")
+    workers.add_argument("--k", type=int, default=20)
+    workers.set_defaults(func=bench_workers)
+
+    args = parser.parse_args()
+    args.func(args)
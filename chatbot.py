@@ -1,20 +1,32 @@
 # Libraries
 from pathlib import Path
-from openai import OpenAI
+from openai import APIError, AsyncOpenAI, OpenAI
 import numpy as np
-import faiss
 import json
 from dotenv import load_dotenv
 import os
-from sentence_transformers import CrossEncoder
-from rank_bm25 import BM25Okapi
-import re
-import torch
+import asyncio
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from vector_index import load_index
+from embeddings import get_provider
+from embedding_cache import QueryEmbeddingCache
+from answer_cache import SemanticAnswerCache
+from lexical_index import SparseBM25, load_or_build, tokenize
+from fusion import align_scores, fuse, union_candidates
+from source_filter import build_source_map, detect_sources, source_ids
+from reranker import Reranker, load_backend
+from memory import HISTORY_TOKEN_BUDGET, ConversationMemory
+from context_builder import CONTEXT_TOKEN_BUDGET, build_context
+from compression import compress_chunks
+from tracing import record, span, tracer
 
 
 load_dotenv()
 client = OpenAI()
-cross_encoder_model = None
+async_client = AsyncOpenAI() # LLM calls of the async answer path
+reranker = None
 
 # Directories
 VECTOR_DIR = Path("data/05_vectorized/small/c400_0")
@@ -24,22 +36,33 @@ def set_vector_dir(path):
     VECTOR_DIR = Path(path)
 
 # ---------------- Embedding ----------------
-def embedding(text: str) -> np.ndarray:
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return np.array(response.data[0].embedding, dtype=np.float32).reshape(1, -1)
-
-def embed_query(query: str) -> np.ndarray:
-    return embedding(query)
+LOCAL_EMBEDDING_THREADS = 2 # CPU threads for a local embedding model when serving
+
+# In-process LRU + optional on-disk store (set EMBEDDING_CACHE_PATH, e.g. cache/query_embeddings.sqlite)
+query_cache = QueryEmbeddingCache(
+    max_entries=10000,
+    path=os.getenv("EMBEDDING_CACHE_PATH")
+)
+
+def embed_query(query: str, manifest: dict | None = None) -> np.ndarray:
+    # Embed with the same provider, model and dimensions the index was built with;
+    # repeated questions are served from the cache without a network hop
+    provider = get_provider(manifest, threads=LOCAL_EMBEDDING_THREADS)
+    return query_cache.get_or_compute(query, provider.cache_namespace, provider.embed_query)
+
+async def embed_query_async(query: str, manifest: dict | None = None) -> np.ndarray:
+    # The API request awaits; the on-disk cache is read and written in stage_pool
+    provider = get_provider(manifest, threads=LOCAL_EMBEDDING_THREADS)
+    return await query_cache.get_or_compute_async(query, provider.cache_namespace, provider.embed_query_async,
+                                                  stage_pool)
 
 # ---------------- FAISS Loader ----------------
 def load_faiss_index(vector_dir: Path):
-    index_path = vector_dir / "db.index"
     meta_path = vector_dir / "db.json"
 
-    index = faiss.read_index(str(index_path))
+    # Any index-factory type built by 04_vectorize (Flat, HNSW, IVF, PQ, ...),
+    # rescored against the memory-mapped full-precision vectors when compressed
+    index = load_index(vector_dir)
 
     with open(meta_path, "r", encoding="utf-8") as f:
         metadata = json.load(f)
@@ -48,165 +71,588 @@ def load_faiss_index(vector_dir: Path):
 
 
 # ---------------- Reranker ----------------
-def get_cross_encoder():
-    global cross_encoder_model
-    if cross_encoder_model is None:
-        from sentence_transformers import CrossEncoder
-        cross_encoder_model = CrossEncoder(
-            "cross-encoder/ms-marco-MiniLM-L-6-v2",
-            device="cpu"
-        )
-    return cross_encoder_model
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch") # or "onnx" (int8; optional packages, python reranker.py export)
+RERANK_MAX_LENGTH = None # tokens per (query, chunk) pair; None: the model's limit (ONNX: 256)
+RERANK_THREADS = 2
+
+# rerank="cascade": skip reranking when the hybrid gap at rank top_k is at least
+# CASCADE_MIN_GAP of the score range, else rerank CASCADE_BATCH chunks at a time
+# until the top_k set stops changing
+CASCADE_MIN_GAP = 0.15
+CASCADE_BATCH = 10
+
+def get_reranker() -> Reranker:
+    global reranker
+    if reranker is None:
+        reranker = Reranker(load_backend(RERANK_BACKEND, max_length=RERANK_MAX_LENGTH, threads=RERANK_THREADS))
+    return reranker
+
+def warmup_reranker():
+    # Load the model and run one pair so the first user does not pay for it
+    get_reranker().warmup()
 
 def rerank_chunks(query: str, candidate_chunks: list, top_k=5):
-    model = get_cross_encoder()
-    pairs = [(query, c["content"]) for c in candidate_chunks]
-    with torch.inference_mode():
-        scores = model.predict(pairs, convert_to_numpy=True)
-
-    scored = sorted(
-        zip(scores, candidate_chunks),
-        key=lambda x: x[0],
-        reverse=True
-    )
-
-    return [c for _, c in scored[:top_k]]
+    # Pairs scored before (same query, same chunk fingerprint) come from the cache
+    return get_reranker().rerank(query, candidate_chunks, top_k=top_k)
 
 
 # ---------------- BM25 ----------------
-def tokenize(text):
-    return re.findall(r"\w+", text.lower())
-
 def build_bm25(metadata):
     corpus = [tokenize(doc["content"]) for doc in metadata]
-    bm25 = BM25Okapi(corpus)
+    bm25 = SparseBM25(corpus) # same scores as rank_bm25.BM25Okapi, vectorized
     return bm25
 
+def load_bm25(vector_dir: Path, metadata):
+    # Prebuilt by 04_vectorize and memory-mapped; rebuilt only for older index folders
+    return load_or_build(vector_dir, metadata)
+
 
 # ---------------- Hybrid Retrieval ----------------
-def retrieve_hybrid(query, index, metadata, bm25, k=20,top_k=5, weight_dense=0.6, weight_sparse=0.4, rerank=False):
-    # Dense retrieval
-    q_vec = embed_query(query)
+# Dense (network-bound embedding + FAISS), sparse (CPU-bound BM25) and moderation
+# run side by side; stage tasks never wait on each other, so the pool cannot deadlock.
+# On the async path embedding and moderation await instead, and the threads only
+# run CPU work (FAISS, BM25, fusion, rerank, compression)
+STAGE_THREADS = 16
+stage_pool = ThreadPoolExecutor(max_workers=STAGE_THREADS, thread_name_prefix="retrieval")
+
+def search_stage(index, q_vec, k, filter_ids, timings=None):
+    with span(timings, "faiss_ms"):
+        D, I = index.search(q_vec, k, ids=filter_ids)
+    return q_vec, D, I
+
+def dense_stage(query, index, k, filter_ids, timings=None):
+    start = time.perf_counter()
+    q_vec = embed_query(query, index.manifest)
     q_vec = q_vec / np.linalg.norm(q_vec)
-    D, I = index.search(q_vec, k)
-    dense_scores = D[0]
-    dense_indices = I[0]
-    dense_scores = (dense_scores - dense_scores.min()) / (dense_scores.max() - dense_scores.min() + 1e-8)
-
-    # Sparse retrieval
-    tokenized_query = tokenize(query)
-    sparse_scores = bm25.get_scores(tokenized_query)
-    sparse_scores = (sparse_scores - np.min(sparse_scores)) / (np.max(sparse_scores) - np.min(sparse_scores) + 1e-8)
+    record(timings, "embed_ms", start)
+    return search_stage(index, q_vec, k, filter_ids, timings)
 
-    # Combine scores
-    hybrid_scores = {}
-    for idx, dense_score in zip(dense_indices, dense_scores):
-        hybrid_scores[idx] = weight_dense * dense_score + weight_sparse * sparse_scores[idx]
+async def dense_stage_async(query, index, k, filter_ids, timings=None):
+    start = time.perf_counter()
+    q_vec = await embed_query_async(query, index.manifest)
+    q_vec = q_vec / np.linalg.norm(q_vec)
+    record(timings, "embed_ms", start)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(stage_pool, search_stage, index, q_vec, k, filter_ids, timings)
+
+def sparse_stage(query, bm25, k, filter_ids, timings=None):
+    # Only the filtered documents are scored and compete for the sparse top k
+    start = time.perf_counter()
+    sparse_ids, sparse_top = bm25.top_k(tokenize(query), k, filter_ids)
+    record(timings, "sparse_ms", start)
+    keep = sparse_top > 0 # drop documents with no query term
+    return sparse_ids[keep], sparse_top[keep]
+
+def retrieval_filter(query, metadata, sources=None, source_map=None, auto_filter=False):
+    # Source filter: explicit source_file list, or programs named in the query
+    if source_map is None and (sources or auto_filter):
+        source_map = build_source_map(metadata)
+    if auto_filter and not sources:
+        sources = detect_sources(query, list(source_map))
+    return source_ids(source_map, sources) if sources else None
+
+def start_retrieval(query, index, metadata, bm25, k=20, sources=None, source_map=None,
+                    auto_filter=False, timings=None):
+    """Submit the dense and sparse stages concurrently; returns their futures."""
+    filter_ids = retrieval_filter(query, metadata, sources, source_map, auto_filter)
+    return {
+        "dense": stage_pool.submit(dense_stage, query, index, k, filter_ids, timings),
+        "sparse": stage_pool.submit(sparse_stage, query, bm25, k, filter_ids, timings),
+    }
+
+def start_retrieval_async(query, index, metadata, bm25, k=20, sources=None, source_map=None,
+                          auto_filter=False, timings=None):
+    """`start_retrieval` on the event loop: asyncio futures, the dense one awaiting its embedding."""
+    filter_ids = retrieval_filter(query, metadata, sources, source_map, auto_filter)
+    loop = asyncio.get_running_loop()
+    return {
+        "dense": asyncio.ensure_future(dense_stage_async(query, index, k, filter_ids, timings)),
+        "sparse": loop.run_in_executor(stage_pool, sparse_stage, query, bm25, k, filter_ids, timings),
+    }
+
+def finish_retrieval(query, dense, sparse, index, metadata, bm25, k=20, top_k=5, weight_dense=0.6, weight_sparse=0.4,
+                     rerank=False, fusion="weighted", rrf_k=60, timings=None):
+    """
+    Fuse the dense (q_vec, D, I) and sparse (ids, scores) stage results (union
+    of candidates) and optionally rerank: rerank=True scores all k candidates,
+    rerank="cascade" only as many as needed.
+    """
+    q_vec, D, I = dense
+    sparse_ids, sparse_top = sparse
+    start = time.perf_counter()
+
+    # Union of both candidate sets
+    candidate_ids = union_candidates(I[0], sparse_ids)
+    if len(candidate_ids) == 0:
+        return []
+
+    if fusion == "weighted":
+        # Exact scores on both sides wherever they can be computed
+        dense = align_scores(candidate_ids, I[0], D[0])
+        missing = np.isnan(dense)
+        if missing.any():
+            dense[missing] = index.score(q_vec, candidate_ids[missing])
+        sparse = align_scores(candidate_ids, sparse_ids, sparse_top)
+        missing = np.isnan(sparse)
+        if missing.any():
+            sparse[missing] = bm25.get_batch_scores(tokenize(query), candidate_ids[missing])
+    else:
+        # Reciprocal ranks only use each retriever's own list
+        dense = align_scores(candidate_ids, I[0], D[0])
+        sparse = align_scores(candidate_ids, sparse_ids, sparse_top)
 
-    # select top k candidates
-    candidate_indices = sorted(hybrid_scores.keys(), key=lambda x: hybrid_scores[x], reverse=True)
-    candidates = [metadata[i] for i in candidate_indices[:k]]
+    fused_ids, fused = fuse(candidate_ids, dense, sparse, method=fusion,
+                        weight_dense=weight_dense, weight_sparse=weight_sparse, rrf_k=rrf_k)
+    candidates = [metadata[i] for i in fused_ids[:k]]
+    record(timings, "fusion_ms", start)
 
     # ---------------- Rerank (optional) ----------------
-    if rerank:
+    if rerank == "cascade":
+        start = time.perf_counter()
+        final_chunks, depth = get_reranker().cascade(query, candidates, fused[:k], top_k=top_k,
+                                                     min_gap=CASCADE_MIN_GAP, batch_size=CASCADE_BATCH)
+        record(timings, "rerank_ms", start)
+        if timings is not None:
+            timings["rerank_depth"] = depth
+    elif rerank:
+        start = time.perf_counter()
         final_chunks = rerank_chunks(query, candidates, top_k=top_k)
+        record(timings, "rerank_ms", start)
     else:
         final_chunks = candidates[:top_k]
-    
+
+    if timings is not None:
+        # (chunk id, hybrid score) of the chunks sent on, for the query log
+        hybrid = {id(c): (int(i), float(score)) for c, i, score in zip(candidates, fused_ids[:k], fused[:k])}
+        timings["retrieved"] = [hybrid[id(c)] for c in final_chunks]
+
     return final_chunks
 
+def retrieve_hybrid(query, index, metadata, bm25, k=20,top_k=5, weight_dense=0.6, weight_sparse=0.4, rerank=False,
+                    sources=None, source_map=None, auto_filter=False, fusion="weighted", rrf_k=60, timings=None):
+    timings = tracer.start(timings)
+    start = time.perf_counter()
+    stages = start_retrieval(query, index, metadata, bm25, k, sources, source_map, auto_filter, timings)
+    chunks = finish_retrieval(query, stages["dense"].result(), stages["sparse"].result(), index, metadata, bm25,
+                              k, top_k, weight_dense, weight_sparse, rerank, fusion, rrf_k, timings)
+    record(timings, "retrieval_ms", start)
+    tracer.finish("retrieval", timings, index_version=index.version, k=k, top_k=top_k, rerank=rerank, fusion=fusion)
+    return chunks
+
+
+# ---------------- Moderation ----------------
+MODERATION_MODEL = "omni-moderation-latest"
+
+def moderation_flagged(query: str, timings=None) -> bool:
+    start = time.perf_counter()
+    mod_result = client.moderations.create(
+        model=MODERATION_MODEL,
+        input=query
+    )
+    record(timings, "moderation_ms", start)
+    return mod_result.results[0].flagged
+
+async def moderation_flagged_async(query: str, timings=None) -> bool:
+    start = time.perf_counter()
+    mod_result = await async_client.moderations.create(
+        model=MODERATION_MODEL,
+        input=query
+    )
+    record(timings, "moderation_ms", start)
+    return mod_result.results[0].flagged
+
+
+# ---------------- Conversation Memory ----------------
+# Fold turns that no longer fit the history budget into a rolling summary (one extra LLM call)
+SUMMARIZE_HISTORY = False
+
+def summarize_turns(summary: str, messages: list[dict], model="gpt-4o-mini") -> str:
+    turns = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{
+            "role": "user",
+            "content": "Atualiza o resumo de uma conversa com as novas mensagens, em Português de Portugal, "
+                       "em no máximo 5 frases. Mantém programas, datas e valores mencionados.\n\n"
+                       f"Resumo atual: {summary or '(vazio)'}\n\nNovas mensagens:\n{turns}"
+        }],
+        temperature=0
+    )
+    return response.choices[0].message.content.strip()
+
+# History per session id; session_id=None (evaluation, benchmarks) is stateless
+memory = ConversationMemory(
+    token_budget=HISTORY_TOKEN_BUDGET,
+    summarizer=summarize_turns if SUMMARIZE_HISTORY else None
+)
 
-# ---------------- Chatbot Answer ----------------
-conversation_history = []
-
-def answer(user_query: str, index, 
-            metadata, bm25, 
-            model="gpt-4o-mini",  
-            k=20,top_k=5, 
-            weight_dense=0.6, 
-            weight_sparse=0.4, 
-            rerank=False):
-
-    global conversation_history
-    max_history = 20
-
-    # TEMPORARY -- UNCOMMENT LATER
-    # Moderation
-    #mod_result = client.moderations.create(
-    #    model="omni-moderation-latest",
-    #    input=user_query
-    #)
-
-    #if mod_result.results[0].flagged:
-    #    return "Query flagged by moderation.", []
-
-    # Retrieve context
-    context_chunks = retrieve_hybrid(user_query, index, metadata, 
-                                     bm25, k,top_k, 
-                                     weight_dense, 
-                                     weight_sparse, 
-                                     rerank)
 
+# ---------------- Chatbot Answer ----------------
+# compress="lexical" (query-term IDF overlap) or "cross-encoder" keeps this share of the sentences
+COMPRESSION_KEEP_RATIO = 0.4
+
+# finish_reason values accepted as an answer
+ANSWER_FINISH_REASONS = ("stop", "length")
+
+# First-turn answers reused for near-duplicate questions (answer(..., use_cache=True))
+answer_cache = SemanticAnswerCache(threshold=0.95, ttl_seconds=24 * 3600, max_entries=1000)
+
+# Parameters of answer, answer_stream, answer_async and answer_stream_async (keyword arguments)
+ANSWER_DEFAULTS = {
+    "model": "gpt-4o-mini",
+    "k": 20,
+    "top_k": 5,
+    "weight_dense": 0.6,
+    "weight_sparse": 0.4,
+    "rerank": False,
+    "sources": None,
+    "source_map": None,
+    "auto_filter": False,
+    "fusion": "weighted",
+    "compress": None,
+    "use_cache": False,
+    "moderate": False,
+    "session_id": None,
+}
+
+# Byte-identical on every request, so the provider can cache it (with the
+# session history that follows) as a prompt prefix; per-request content
+# (context, question) goes in the last message. On its own (~150 tokens) it is
+# below the 1024-token caching minimum: hits start once earlier turns extend it
+SYSTEM_PROMPT = """És um assistente especialista em programas de incentivos nacionais e regionais, como o PT2030, Compete2030, Alentejo2030, etc.
+Responde sempre em Português de Portugal.
+
+Regras:
+- Responde de forma clara e concisa, não repitas informação.
+- Usa TODA a informação relevante do contexto para responder de forma completa.
+- Se existirem múltiplos pontos relevantes no contexto, inclui todos.
+- Não ignores informação relevante.
+- Se não souberes a resposta ou se não houver informação no contexto, informa o utilizador e pergunta se podes ajudar noutro tema.
+- Sempre que possível, indica a fonte (link ou nome do ficheiro)."""
+
+def build_messages(user_query: str, context_chunks: list, session_id=None) -> list[dict]:
+    # Chunks of the same page are merged (no chunk_overlap repeats) and packed
+    # best first into the context budget
     context_text = "\n\n".join(
         f"[{c['source_file']}]\n\nTexto: {c['content']}"
-        for c in context_chunks
+        for c in build_context(context_chunks, CONTEXT_TOKEN_BUDGET)
     )
 
-    prompt = f"""
-        És um assistente especialista em programas de incentivos nacionais e regionais, como o PT2030, Compete2030, Alentejo2030, etc.
-        Responde sempre em Português de Portugal.
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    messages.extend(memory.history(session_id))
+    messages.append({"role": "user", "content": f"Contexto:\n{context_text}\n\nPergunta: {user_query}"})
+    return messages
+
+def record_usage(timings, usage):
+    # Prompt tokens served from the provider's prefix cache (cheaper, lower latency)
+    if timings is None or not usage:
+        return
+    usage = usage if isinstance(usage, dict) else usage.model_dump()
+    timings["prompt_tokens"] = usage.get("prompt_tokens") or 0
+    timings["cached_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+def check_finish_reason(finish_reason):
+    # "length" is a truncated but usable answer; content_filter, tool calls or a
+    # stream cut short (None) are not answers to cache or remember
+    if finish_reason not in ANSWER_FINISH_REASONS:
+        raise RuntimeError(f"Chat completion ended with finish_reason={finish_reason!r}")
+
+def finish_answer(user_query, final_answer, context_chunks, index, cache_key, session_id):
+    # An empty answer is neither cached nor added to the history
+    if not final_answer:
+        return
+    if cache_key is not None:
+        q_vec, cache_params = cache_key
+        answer_cache.store(q_vec, index.version, cache_params, final_answer, context_chunks)
+    memory.add(session_id, user_query, final_answer)
+
+class AnswerTurn:
+    """
+    One question through the answer path. answer, answer_stream, answer_async
+    and answer_stream_async only differ in how they call the LLM; moderation,
+    answer cache, retrieval, prompt, timings, history and tracing live here.
+    """
+
+    def __init__(self, user_query: str, index, metadata, bm25, timings=None, **params):
+        unknown = set(params) - set(ANSWER_DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown answer parameter(s): {', '.join(sorted(unknown))}")
+        self.params = SimpleNamespace(**{**ANSWER_DEFAULTS, **params})
+        self.user_query = user_query
+        self.index, self.metadata, self.bm25 = index, metadata, bm25
+        self.timings = tracer.start(timings) # a dict when tracing, even if the caller passed none
+        self.start = time.perf_counter()
+        self.answer, self.context_chunks, self.cache_key = None, [], None
+        self.parts = []
+
+    @property
+    def result(self) -> tuple:
+        return self.answer, self.context_chunks
+
+    def prepare(self) -> bool:
+        """
+        Moderation, answer cache and retrieval. Returns False when no LLM call
+        is needed (flagged or cached: `answer` is set), else True.
+        """
+        p, timings = self.params, self.timings
+        start = time.perf_counter()
 
-        Regras:
-        - Responde de forma clara e concisa, não repitas informação.
-        - Usa TODA a informação relevante do contexto para responder de forma completa.
-        - Se existirem múltiplos pontos relevantes no contexto, inclui todos.
-        - Não ignores informação relevante.
-        - Se não souberes a resposta ou se não houver informação no contexto, informa o utilizador e pergunta se podes ajudar noutro tema.
-        - Sempre que possível, indica a fonte (link ou nome do ficheiro).
+        # Moderation runs alongside retrieval instead of before it
+        mod_future = stage_pool.submit(moderation_flagged, self.user_query, timings) if p.moderate else None
 
-        Contexto:
-        {context_text}
+        # Dense and sparse retrieval stages start right away
+        stages = start_retrieval(self.user_query, self.index, self.metadata, self.bm25, p.k, p.sources,
+                                 p.source_map, p.auto_filter, timings)
 
-        Pergunta: {user_query}
-        Resposta:
-        """
+        def flagged():
+            return mod_future is not None and mod_future.result()
 
-    messages = [{"role": "system", "content": prompt}]
-    conversation_history = conversation_history[-max_history:]
-    messages.extend(conversation_history)
-    messages.append({"role": "user", "content": user_query})
+        if self.cacheable():
+            cached = self.lookup_cache(stages["dense"].result()[0]) # query embedding from the dense stage
+            if cached is not None:
+                return self.stop(stages, flagged(), cached)
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0
-    )
+        if flagged():
+            return self.stop(stages, flagged=True)
 
-    final_answer = response.choices[0].message.content.strip()
+        self.retrieve(stages["dense"].result(), stages["sparse"].result(), start)
+        return True
 
-    conversation_history.append({"role": "user", "content": user_query})
-    conversation_history.append({"role": "assistant", "content": final_answer})
+    async def prepare_async(self) -> bool:
+        """
+        `prepare` on the event loop: moderation and the query embedding await
+        the async client, so stage_pool threads are only held while BM25,
+        FAISS, fusion, rerank and compression compute.
+        """
+        p, timings = self.params, self.timings
+        start = time.perf_counter()
+
+        mod_task = asyncio.ensure_future(moderation_flagged_async(self.user_query, timings)) if p.moderate else None
+        stages = start_retrieval_async(self.user_query, self.index, self.metadata, self.bm25, p.k, p.sources,
+                                       p.source_map, p.auto_filter, timings)
+
+        async def flagged():
+            return mod_task is not None and await mod_task
+
+        if self.cacheable():
+            cached = self.lookup_cache((await stages["dense"])[0])
+            if cached is not None:
+                return self.stop(stages, await flagged(), cached)
+
+        if await flagged():
+            return self.stop(stages, flagged=True)
+
+        dense, sparse = await asyncio.gather(stages["dense"], stages["sparse"])
+        await asyncio.get_running_loop().run_in_executor(stage_pool, self.retrieve, dense, sparse, start)
+        return True
+
+    def cacheable(self) -> bool:
+        # Semantic answer cache: first turn only, follow-ups depend on the history
+        return self.params.use_cache and not memory.has(self.params.session_id)
+
+    def lookup_cache(self, q_vec):
+        p = self.params
+        # Programs named in the question are part of the key: "Algarve 2030" and
+        # "Norte 2030" variants of a question embed very close to each other
+        named = tuple(detect_sources(self.user_query, list(p.source_map))) if p.source_map else ()
+        cache_params = (p.model, p.k, p.top_k, p.weight_dense, p.weight_sparse, p.rerank, tuple(p.sources or ()),
+                        p.auto_filter, p.fusion, p.compress, named)
+        self.cache_key = (q_vec, cache_params)
+        return answer_cache.lookup(q_vec, self.index.version, cache_params)
+
+    def stop(self, stages, flagged, cached=None) -> bool:
+        """End without an LLM call: flagged by moderation, else answered from the cache."""
+        if flagged:
+            # Fail fast: in-flight stages are cancelled (or abandoned if already running)
+            for future in stages.values():
+                future.cancel()
+            self.answer = "Query flagged by moderation."
+        else:
+            self.answer, self.context_chunks = cached
+            memory.add(self.params.session_id, self.user_query, self.answer)
+        self.end_trace(llm=False)
+        return False
+
+    def retrieve(self, dense, sparse, start):
+        # Fusion and rerank of the stage results, then optional compression
+        p, timings = self.params, self.timings
+        self.context_chunks = finish_retrieval(self.user_query, dense, sparse, self.index, self.metadata,
+                                               self.bm25, p.k, p.top_k, p.weight_dense, p.weight_sparse, p.rerank,
+                                               fusion=p.fusion, timings=timings)
+        record(timings, "retrieval_ms", start)
+
+        # Optional extractive compression: only the sentences relevant to the question go in the prompt
+        if p.compress:
+            compress_start = time.perf_counter()
+            self.context_chunks = compress_chunks(self.user_query, self.context_chunks, method=p.compress,
+                                                  bm25=self.bm25,
+                                                  reranker=get_reranker() if p.compress == "cross-encoder" else None,
+                                                  keep_ratio=COMPRESSION_KEEP_RATIO)
+            record(timings, "compress_ms", compress_start)
+
+    def request(self, **kwargs) -> dict:
+        """Chat completion arguments; starts the LLM clock."""
+        with span(self.timings, "prompt_ms"):
+            messages = build_messages(self.user_query, self.context_chunks, self.params.session_id)
+        self.llm_start = time.perf_counter()
+        return {"model": self.params.model, "messages": messages, "temperature": 0, **kwargs}
+
+    def add_delta(self, delta: str):
+        if not self.parts:
+            record(self.timings, "ttft_ms", self.start) # what the user waits for
+            record(self.timings, "llm_first_token_ms", self.llm_start)
+        self.parts.append(delta)
+
+    def finish(self, content: str | None = None, usage=None) -> tuple:
+        """Record the LLM call, then update history and cache with `content` (default: the streamed deltas)."""
+        record(self.timings, "llm_ms", self.llm_start)
+        record_usage(self.timings, usage)
+        self.answer = (content if content is not None else "".join(self.parts)).strip()
+        finish_answer(self.user_query, self.answer, self.context_chunks, self.index, self.cache_key,
+                      self.params.session_id)
+        self.end_trace()
+        return self.result
+
+    def end_trace(self, llm=True):
+        # llm=False: answered from the cache or stopped by moderation
+        p = self.params
+        record(self.timings, "total_ms", self.start)
+        tracer.finish("answer", self.timings, index_version=self.index.version, model=p.model,
+                      rerank=p.rerank, fusion=p.fusion, compress=p.compress, llm=llm)
+
+def answer(user_query: str, index, metadata, bm25, *, timings=None, **params):
+    """Answer a question; `params` as in ANSWER_DEFAULTS. Returns (final_answer, context_chunks)."""
+    turn = AnswerTurn(user_query, index, metadata, bm25, timings, **params)
+    if turn.prepare():
+        response = client.chat.completions.create(**turn.request())
+        check_finish_reason(response.choices[0].finish_reason)
+        turn.finish(response.choices[0].message.content or "", response.usage)
+
+    print("\nAssistente:", turn.answer)
+    return turn.result
+
+def answer_stream(user_query: str, index, metadata, bm25, *, timings=None, **params):
+    """
+    Streaming variant of `answer`: yields text deltas as the model produces
+    them. The generator's return value (StopIteration.value) is
+    (final_answer, context_chunks); history and cache are updated at the end.
+    """
+    turn = AnswerTurn(user_query, index, metadata, bm25, timings, **params)
+    if not turn.prepare():
+        yield turn.answer
+        return turn.result
+
+    stream = client.chat.completions.create(
+        **turn.request(stream=True, stream_options={"include_usage": True}) # usage arrives in a last chunk without choices
+    )
+    finish_reason = usage = None
+    for chunk in stream:
+        if not chunk.choices:
+            usage = chunk.usage
+            continue
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+        delta = chunk.choices[0].delta.content
+        if delta:
+            turn.add_delta(delta)
+            yield delta
+    check_finish_reason(finish_reason)
+    return turn.finish(usage=usage)
+
+# ---------------- Async Answer ----------------
+# answer_async / answer_stream_async hold no thread while waiting on the network.
+# Blocking calls made from asyncio code that wait on stage_pool (e.g. retrieve_hybrid
+# in replay.py) run here: a separate pool, so they cannot starve the stages they wait on
+ANSWER_THREADS = 64
+answer_pool = ThreadPoolExecutor(max_workers=ANSWER_THREADS, thread_name_prefix="answer")
+
+async def stream_deltas_async(timings=None, **kwargs):
+    """
+    Content deltas of a streamed chat completion. The SSE lines are parsed
+    with json directly: building the SDK's pydantic chunk objects costs far
+    more CPU than the answer itself once hundreds of streams share a process.
+    Raises APIError on an error event and RuntimeError when the stream ends
+    without an accepted finish_reason, like the SDK's own stream would.
+    """
+    async with async_client.chat.completions.with_streaming_response.create(
+        stream=True, stream_options={"include_usage": True}, **kwargs
+    ) as response:
+        if response.status_code != 200:
+            raise APIError(f"Chat completion failed with HTTP {response.status_code}",
+                           response.http_request, body=await response.text())
+
+        event = None
+        finish_reason = None
+        async for line in response.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):].strip()
+                continue
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            chunk = json.loads(line[len("data: "):])
+            if event == "error" or "error" in chunk:
+                error = chunk.get("error", chunk)
+                message = error.get("message") if isinstance(error, dict) else None
+                raise APIError(message or "An error occurred during streaming",
+                               response.http_request, body=error)
+            event = None
+
+            record_usage(timings, chunk.get("usage"))
+            for choice in chunk.get("choices", []):
+                finish_reason = choice.get("finish_reason") or finish_reason
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+        check_finish_reason(finish_reason)
+
+async def answer_async(user_query: str, index, metadata, bm25, *, timings=None, **params):
+    """`answer` for asyncio callers: the LLM call awaits instead of holding a thread."""
+    turn = AnswerTurn(user_query, index, metadata, bm25, timings, **params)
+    if await turn.prepare_async():
+        response = await async_client.chat.completions.create(**turn.request())
+        check_finish_reason(response.choices[0].finish_reason)
+        turn.finish(response.choices[0].message.content or "", response.usage)
+    return turn.result
+
+async def answer_stream_async(user_query: str, index, metadata, bm25, *, timings=None, result=None, **params):
+    """
+    Async generator version of `answer_stream`. Async generators cannot
+    return a value, so (final_answer, context_chunks) is stored in
+    `result["answer"]` / `result["context_chunks"]` when the stream ends.
+    """
+    turn = AnswerTurn(user_query, index, metadata, bm25, timings, **params)
+    if await turn.prepare_async():
+        async for delta in stream_deltas_async(timings=turn.timings, **turn.request()):
+            turn.add_delta(delta)
+            yield delta
+        turn.finish()
+    else:
+        yield turn.answer
 
-    print("\nAssistente:", final_answer)
-    return final_answer, context_chunks
+    if result is not None:
+        result["answer"], result["context_chunks"] = turn.result
 
 # ---------------- Main Loop ----------------
 def main():
     index, metadata = load_faiss_index(VECTOR_DIR)
 
-    bm25 = build_bm25(metadata)
+    bm25 = load_bm25(VECTOR_DIR, metadata)
 
     while True:
         user_query = input("\nPergunta: ").strip()
         if user_query.lower() in ["sair", "exit", "quit"]:
             print("Assistente: Até à próxima!")
             break
+        timings = {}
         answer(user_query, index, metadata, bm25, 
                     model="gpt-4o-mini",  
                     k=20,top_k=5, 
                     weight_dense=0.6, 
                     weight_sparse=0.4, 
-                    rerank=False)
+                    rerank=False,
+                    session_id="cli",
+                    timings=timings)
+        # Stages overlap: retrieval_ms is close to max(embed + faiss, sparse), not their sum
+        print("[TIMINGS]", ", ".join(f"{name}={ms:.0f}" for name, ms in timings.items() if name.endswith("_ms")))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+# Libraries
+import re
+import numpy as np
+from lexical_index import tokenize
+from context_builder import SOURCE_PREFIX
+
+
+COMPRESSION_METHODS = ("lexical", "cross-encoder")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> tuple[str, list[str]]:
+    """("Fonte: <title>: " prefix or "", sentences) of a chunk."""
+    prefix = SOURCE_PREFIX.match(text)
+    label = prefix.group() if prefix else ""
+    sentences = [s.strip() for s in SENTENCE_END.split(text[len(label):]) if s.strip()]
+    return label, sentences
+
+
+# ---------------- Scoring ----------------
+def lexical_scores(query: str, sentences: list[str], bm25) -> np.ndarray:
+    """Sum of the BM25 IDFs of the query terms each sentence contains."""
+    idf = {t: bm25.idf[bm25.vocab[t]] for t in set(tokenize(query)) if t in bm25.vocab}
+    return np.array([sum(idf.get(t, 0.0) for t in set(tokenize(s))) for s in sentences], dtype=np.float64)
+
+
+def cross_encoder_scores(query: str, sentences: list[str], reranker) -> np.ndarray:
+    # Reranker caches per (query, text), so repeated sentences are scored once
+    return np.asarray(reranker.score(query, [{"content": s} for s in sentences]), dtype=np.float64)
+
+
+# ---------------- Compression ----------------
+def compress_chunks(query: str, chunks: list[dict], method: str = "lexical", bm25=None, reranker=None,
+                    keep_ratio: float = 0.4) -> list[dict]:
+    """
+    Extractive compression of the retrieved chunks.
+
+    Sentences of all chunks are scored against the query; the best
+    `keep_ratio` of them are kept, plus the best sentence of every chunk so
+    no source disappears. Kept sentences stay in their original order
+    behind the chunk's "Fonte: <title>: " label, and a sentence already
+    kept for the same URL (chunk_overlap repeats) is not repeated.
+    Returns copies of the chunks with the compressed content.
+    """
+    split = [split_sentences(c["content"]) for c in chunks]
+    owner = [i for i, (_, sentences) in enumerate(split) for _ in sentences]
+    sentences = [s for _, chunk_sentences in split for s in chunk_sentences]
+    if not sentences:
+        return chunks
+
+    if method == "lexical":
+        scores = lexical_scores(query, sentences, bm25)
+    elif method == "cross-encoder":
+        scores = cross_encoder_scores(query, sentences, reranker)
+    else:
+        raise ValueError(f"Unknown compression method '{method}', expected one of {COMPRESSION_METHODS}")
+
+    order = np.argsort(-scores, kind="stable")
+    keep = set(order[:max(1, int(np.ceil(keep_ratio * len(sentences))))].tolist())
+    best_per_chunk = {}
+    for i in order.tolist():
+        best_per_chunk.setdefault(owner[i], i)
+    keep.update(best_per_chunk.values())
+
+    kept = [[] for _ in chunks]
+    seen = set()
+    for i in sorted(keep):
+        key = (chunks[owner[i]]["url"], sentences[i].lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        kept[owner[i]].append(sentences[i])
+
+    compressed = []
+    for chunk, (label, _), chunk_sentences in zip(chunks, split, kept):
+        if chunk_sentences:
+            compressed.append({**chunk, "content": label + " ".join(chunk_sentences)})
+    return compressed
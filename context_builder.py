@@ -0,0 +1,108 @@
+# Libraries
+import re
+import tiktoken
+
+
+CONTEXT_TOKEN_BUDGET = 3000 # context tokens per prompt
+ENCODING = "o200k_base" # gpt-4o / gpt-4o-mini
+MIN_OVERLAP = 20 # shortest chunk_overlap repeat (characters) that is merged
+SOURCE_PREFIX = re.compile(r"^Fonte: [^:]*: ") # added to every web chunk by 02_chunk
+
+
+def count_tokens(text: str) -> int:
+    return len(tiktoken.get_encoding(ENCODING).encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = tiktoken.get_encoding(ENCODING)
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+# ---------------- Merging ----------------
+def overlap_length(a: str, b: str, min_overlap: int = MIN_OVERLAP) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (0 if shorter than min_overlap)."""
+    if min(len(a), len(b)) < min_overlap:
+        return 0
+    head = b[:min_overlap]
+    start = max(0, len(a) - len(b))
+    while True:
+        pos = a.find(head, start)
+        if pos == -1:
+            return 0
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        start = pos + 1
+
+
+def merge_spans(chunks: list[tuple[int, dict]]) -> list[dict]:
+    """
+    Merge the (rank, chunk) pairs of one URL into spans of consecutive
+    chunk_ids: the text repeated by chunk_overlap and the "Fonte: ..."
+    prefix of every chunk after the first are dropped.
+    """
+    spans = []
+    for rank, chunk in sorted(chunks, key=lambda rc: rc[1]["chunk_id"]):
+        text = chunk["content"]
+        last = spans[-1] if spans else None
+
+        if last is not None and chunk["chunk_id"] == last["chunk_ids"][-1] + 1:
+            prefix = SOURCE_PREFIX.match(last["content"])
+            if prefix and text.startswith(prefix.group()):
+                text = text[prefix.end():]
+            overlap = overlap_length(last["content"], text)
+            last["content"] += text[overlap:] if overlap else " " + text
+            last["chunk_ids"].append(chunk["chunk_id"])
+            last["rank"] = min(last["rank"], rank)
+        else:
+            spans.append({
+                "url": chunk["url"],
+                "source_file": chunk["source_file"],
+                "chunk_ids": [chunk["chunk_id"]],
+                "content": text,
+                "rank": rank,
+            })
+    return spans
+
+
+# ---------------- Packing ----------------
+def build_context(chunks: list[dict], token_budget: int | None = CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """
+    Context blocks for the prompt from ranked chunks (best first).
+
+    Chunks are grouped by URL and merged into spans (`merge_spans`); spans
+    are then added best rank first while they fit in `token_budget`
+    (the best span is truncated if it alone does not). Each returned block
+    is one URL: {"url", "source_file", "chunk_ids", "content"}, ordered by
+    its best rank, with its spans in document order.
+    """
+    by_url = {}
+    for rank, chunk in enumerate(chunks):
+        by_url.setdefault(chunk["url"], []).append((rank, chunk))
+
+    spans = sorted((s for group in by_url.values() for s in merge_spans(group)), key=lambda s: s["rank"])
+
+    selected = []
+    used = 0
+    for span in spans:
+        tokens = count_tokens(span["content"])
+        if token_budget is not None and used + tokens > token_budget:
+            if selected:
+                continue
+            span["content"] = truncate_tokens(span["content"], token_budget)
+            tokens = token_budget
+        selected.append(span)
+        used += tokens
+
+    blocks = {}
+    for span in sorted(selected, key=lambda s: s["rank"]):
+        blocks.setdefault(span["url"], []).append(span)
+
+    return [
+        {
+            "url": url,
+            "source_file": group[0]["source_file"],
+            "chunk_ids": [i for s in sorted(group, key=lambda s: s["chunk_ids"][0]) for i in s["chunk_ids"]],
+            "content": " [...] ".join(s["content"] for s in sorted(group, key=lambda s: s["chunk_ids"][0])),
+        }
+        for url, group in blocks.items()
+    ]
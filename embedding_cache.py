@@ -0,0 +1,126 @@
+# Libraries
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    Two-level cache of query embeddings keyed by (embedding namespace,
+    normalized query text): an in-process LRU in front of an optional
+    SQLite store that survives restarts and is shared by worker processes.
+    """
+
+    def __init__(self, max_entries: int = 10000, path: str | Path | None = None):
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.path = Path(path) if path else None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.path), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, dim INTEGER, vector BLOB)")
+        db.commit()
+        return db
+
+    def after_fork(self):
+        # A SQLite connection must not be used across fork: each worker opens its own
+        if self.path is not None:
+            self._db = self._connect()
+
+    @staticmethod
+    def key(text: str, namespace: str) -> str:
+        return hashlib.sha1(f"{namespace}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def _disk_get(self, key: str) -> np.ndarray | None:
+        row = self._db.execute("SELECT dim, vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        dim, blob = row
+        return np.frombuffer(blob, dtype=np.float32).reshape(1, dim)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+
+            if self._db is not None:
+                vector = self._disk_get(key)
+                if vector is not None:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: np.ndarray):
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, -1)
+        vector.flags.writeable = False # shared between callers
+
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                    (key, vector.shape[1], vector.tobytes())
+                )
+                self._db.commit()
+        return vector
+
+    def get_or_compute(self, text: str, namespace: str, compute) -> np.ndarray:
+        key = self.key(text, namespace)
+        vector = self.get(key)
+        if vector is None:
+            vector = self.put(key, compute(text))
+        return vector
+
+    async def get_or_compute_async(self, text: str, namespace: str, compute, executor=None) -> np.ndarray:
+        """`get_or_compute` with a coroutine `compute`; the SQLite store is read and written in `executor`."""
+        loop = asyncio.get_running_loop()
+        key = self.key(text, namespace)
+        vector = await loop.run_in_executor(executor, self.get, key) if self._db is not None else self.get(key)
+        if vector is None:
+            vector = await compute(text)
+            if self._db is not None:
+                vector = await loop.run_in_executor(executor, self.put, key, vector)
+            else:
+                vector = self.put(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self._lru),
+        }
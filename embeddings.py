@@ -0,0 +1,189 @@
+# Libraries
+import asyncio
+import json
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
+
+
+DEFAULT_OPENAI_MODEL = "text-embedding-3-small"
+DEFAULT_LOCAL_MODEL = "intfloat/multilingual-e5-small"
+
+
+# ---------------- Providers ----------------
+class EmbeddingProvider:
+    """
+    Common interface used by 04_vectorize (documents) and chatbot (queries).
+    `embed_*` return L2-normalized float32 arrays of shape (n, dim).
+    """
+    name = "base"
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> np.ndarray:
+        raise NotImplementedError
+
+    async def embed_query_async(self, text: str) -> np.ndarray:
+        # Default for CPU-bound providers: compute in a thread, off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_query, text)
+
+    def manifest_fields(self) -> dict:
+        """Everything the server needs to embed queries like the corpus."""
+        raise NotImplementedError
+
+    @property
+    def cache_namespace(self) -> str:
+        # Embeddings are only interchangeable between identical configurations
+        return json.dumps(self.manifest_fields(), sort_keys=True)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, model: str = DEFAULT_OPENAI_MODEL, dimensions: int | None = None,
+                 batch_size: int = 256, client: OpenAI | None = None):
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.client = client or OpenAI()
+        self.async_client = None # created on first async use, in the serving process
+
+    def _request(self, texts: list[str]) -> dict:
+        kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+        return {"model": self.model, "input": texts, **kwargs}
+
+    @staticmethod
+    def _vectors(response) -> np.ndarray:
+        data = sorted(response.data, key=lambda d: d.index)
+        return np.array([d.embedding for d in data], dtype=np.float32)
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        return self._vectors(self.client.embeddings.create(**self._request(texts)))
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        batches = [self._embed(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return normalize(np.vstack(batches))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return normalize(self._embed([text]))
+
+    async def embed_query_async(self, text: str) -> np.ndarray:
+        # Awaits the API instead of holding a thread for the round trip
+        if self.async_client is None:
+            self.async_client = AsyncOpenAI()
+        response = await self.async_client.embeddings.create(**self._request([text]))
+        return normalize(self._vectors(response))
+
+    def manifest_fields(self) -> dict:
+        return {
+            "embedding_provider": self.name,
+            "embedding_model": self.model,
+            "dimensions": self.dimensions,
+        }
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    sentence-transformers model on CPU, with the torch or ONNX Runtime
+    backend. `threads` pins the intra-op thread count so a serving process
+    does not oversubscribe the cores it shares with BM25 and the web server.
+    E5-style models expect "query: " / "passage: " prefixes.
+    """
+    name = "local"
+
+    def __init__(self, model: str = DEFAULT_LOCAL_MODEL, backend: str = "torch",
+                 batch_size: int = 32, threads: int | None = None,
+                 query_prefix: str = "query: ", document_prefix: str = "passage: "):
+        self.model_name = model
+        self.backend = backend
+        self.batch_size = batch_size
+        self.threads = threads
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+        self.model = self._load()
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+
+        model_kwargs = {}
+        if self.backend == "onnx":
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise ImportError("The onnx embedding backend needs optional packages: "
+                                  "pip install onnxruntime optimum") from None
+            options = ort.SessionOptions()
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = 1
+            model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+        elif self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+
+        return SentenceTransformer(self.model_name, device="cpu", backend=self.backend, model_kwargs=model_kwargs)
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return vectors.astype(np.float32).reshape(len(texts), -1)
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        return self._encode([self.document_prefix + t for t in texts])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._encode([self.query_prefix + text])
+
+    def manifest_fields(self) -> dict:
+        return {
+            "embedding_provider": self.name,
+            "embedding_model": self.model_name,
+            "embedding_backend": self.backend,
+            "query_prefix": self.query_prefix,
+            "document_prefix": self.document_prefix,
+            "dimensions": None,
+        }
+
+
+# ---------------- Factory ----------------
+_providers = {}
+
+def get_provider(manifest: dict | None = None, **overrides) -> EmbeddingProvider:
+    """
+    Provider matching an index manifest (defaults to OpenAI text-embedding-3-small
+    for indexes built before providers were recorded). Instances are cached,
+    so a local model is loaded once per process.
+    """
+    manifest = {**(manifest or {}), **overrides}
+    name = manifest.get("embedding_provider", "openai")
+
+    if name == "openai":
+        key = (name, manifest.get("embedding_model", DEFAULT_OPENAI_MODEL), manifest.get("dimensions"))
+        if key not in _providers:
+            _providers[key] = OpenAIEmbeddingProvider(model=key[1], dimensions=key[2])
+
+    elif name == "local":
+        key = (name, manifest.get("embedding_model", DEFAULT_LOCAL_MODEL), manifest.get("embedding_backend", "torch"))
+        if key not in _providers:
+            _providers[key] = LocalEmbeddingProvider(
+                model=key[1],
+                backend=key[2],
+                threads=manifest.get("threads"),
+                query_prefix=manifest.get("query_prefix", "query: "),
+                document_prefix=manifest.get("document_prefix", "passage: ")
+            )
+
+    else:
+        raise ValueError(f"Unknown embedding provider '{name}'")
+
+    return _providers[key]
@@ -45,7 +45,9 @@ k = 15
 top_k = 15
 weight_dense = 0.6
 weight_sparse = 0.4
-rerank = False
+rerank = False # True (all k candidates), "cascade" (adaptive depth) or False
+fusion = "weighted" # "weighted" (min-max) or "rrf" (reciprocal rank) over dense ∪ sparse candidates
+compress = None # None, "lexical" or "cross-encoder": keep only the question-relevant sentences of each chunk
 
 # ---- Load evaluation dataset ----
 with open("evaluation/evaluation_dataset_v2.json", "r", encoding="utf-8") as f:
@@ -56,12 +58,12 @@ eval_dataset = utils.json_to_documents(data)
 # ---- Load FAISS index and metadata ----
 chatbot.set_vector_dir(f"data/05_vectorized/{embeddings_type}/c{chunk_size}_{chunk_overlap}")
 index, metadata = chatbot.load_faiss_index(chatbot.VECTOR_DIR)
-bm25=chatbot.build_bm25(metadata)
+bm25=chatbot.load_bm25(chatbot.VECTOR_DIR, metadata)
 print(f"Index and metadata loaded at {chatbot.VECTOR_DIR}")
 
 
 # ---- Populate evaluation dataset with retrieved contexts ----
-filename = f"eval_dataset_filled_{embeddings_type}_c{chunk_size}_{chunk_overlap}__{k}_{top_k}_{weight_dense}_{weight_sparse}_{rerank}.json"
+filename = f"eval_dataset_filled_{embeddings_type}_c{chunk_size}_{chunk_overlap}__{k}_{top_k}_{weight_dense}_{weight_sparse}_{rerank}_{fusion}{f'_{compress}' if compress else ''}.json"
 filepath = Path("evaluation") / filename
 
 if not filepath.exists():
@@ -75,7 +77,9 @@ if not filepath.exists():
         top_k=top_k,
         weight_dense=weight_dense,
         weight_sparse=weight_sparse,
-        rerank=rerank
+        rerank=rerank,
+        fusion=fusion,
+        compress=compress
     )
     
     with open(filepath, "w") as f:
@@ -0,0 +1,67 @@
+# Libraries
+import numpy as np
+
+
+FUSION_METHODS = ("weighted", "rrf")
+
+
+# ---------------- Candidates ----------------
+def union_candidates(*id_lists) -> np.ndarray:
+    """Sorted unique ids over several ranked lists, ignoring FAISS -1 padding."""
+    ids = np.concatenate([np.asarray(l, dtype=np.int64).ravel() for l in id_lists])
+    return np.unique(ids[ids >= 0])
+
+
+def align_scores(candidates: np.ndarray, ids: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    """Scores of `ids` placed at their position in `candidates`; NaN where not retrieved."""
+    aligned = np.full(len(candidates), np.nan)
+    ids = np.asarray(ids, dtype=np.int64)
+    keep = ids >= 0
+    aligned[np.searchsorted(candidates, ids[keep])] = np.asarray(scores, dtype=np.float64)[keep]
+    return aligned
+
+
+# ---------------- Fusion ----------------
+def minmax(scores: np.ndarray) -> np.ndarray:
+    """Min-max normalization over the non-NaN entries; NaN (not retrieved) becomes 0."""
+    out = np.zeros(len(scores))
+    present = ~np.isnan(scores)
+    if present.any():
+        s = scores[present]
+        out[present] = (s - s.min()) / (s.max() - s.min() + 1e-8)
+    return out
+
+
+def reciprocal_ranks(scores: np.ndarray, rrf_k: int = 60) -> np.ndarray:
+    """1 / (rrf_k + rank), rank 1 = best non-NaN score; NaN (not retrieved) becomes 0."""
+    out = np.zeros(len(scores))
+    present = np.flatnonzero(~np.isnan(scores))
+    order = present[np.argsort(-scores[present], kind="stable")]
+    out[order] = 1.0 / (rrf_k + np.arange(1, len(order) + 1))
+    return out
+
+
+def fuse(candidates: np.ndarray, dense: np.ndarray, sparse: np.ndarray, method: str = "weighted",
+         weight_dense: float = 0.6, weight_sparse: float = 0.4, rrf_k: int = 60):
+    """
+    Fuse dense and sparse scores over a candidate set.
+
+    Contract:
+    - `candidates` are unique ids; `dense` and `sparse` are aligned with
+      them, NaN marking a candidate the retriever did not return.
+    - "weighted": weight_dense * minmax(dense) + weight_sparse * minmax(sparse),
+      each normalized over its own non-NaN scores; a missing score counts as 0.
+    - "rrf": weight_dense / (rrf_k + dense rank) + weight_sparse / (rrf_k + sparse rank);
+      a missing rank contributes 0.
+    - Returns (ids, fused) sorted by fused score, best first; ties keep the
+      lower id first.
+    """
+    if method == "weighted":
+        fused = weight_dense * minmax(dense) + weight_sparse * minmax(sparse)
+    elif method == "rrf":
+        fused = weight_dense * reciprocal_ranks(dense, rrf_k) + weight_sparse * reciprocal_ranks(sparse, rrf_k)
+    else:
+        raise ValueError(f"Unknown fusion method '{method}', expected one of {FUSION_METHODS}")
+
+    order = np.argsort(-fused, kind="stable")
+    return candidates[order], fused[order]
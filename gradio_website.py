@@ -1,10 +1,19 @@
 import gradio as gr
-from chatbot import load_faiss_index, build_bm25, answer
+from chatbot import load_faiss_index, load_bm25, answer_stream_async, warmup_reranker, memory
+from source_filter import build_source_map
+from streaming import UI_UPDATE_MS, coalesce_async
+from tracing import tracer
+from query_log import QueryLog
+from snapshot import SNAPSHOT_ROOT, current_version
+from registry import IndexRegistry
+import os
 from pathlib import Path
 import json
 import time
 import uuid
+from contextlib import nullcontext
 from datetime import datetime
+from types import SimpleNamespace
 
 
 
@@ -19,9 +28,38 @@ if not USERS_FILE.exists():
         json.dump({}, f)
 
 
-# Load FAISS index and metadata once
-index, metadata = load_faiss_index(VECTOR_DIR)
-bm25 = build_bm25(metadata)
+# Serve the current retrieval snapshot (memory-mapped, ~1s), hot-reloaded when snapshots/CURRENT
+# changes (watcher started in launch); without one, the vectorized folder, fixed until restart
+if current_version(SNAPSHOT_ROOT):
+    registry = IndexRegistry(SNAPSHOT_ROOT)
+    print(f"[INFO] Serving snapshot {registry.version}")
+else:
+    registry = None
+    index, metadata = load_faiss_index(VECTOR_DIR)
+    static_index = SimpleNamespace(index=index, chunks=metadata, bm25=load_bm25(VECTOR_DIR, metadata),
+                                   source_map=build_source_map(metadata))
+
+def acquire_index():
+    # Held for a whole answer, so a reload never switches index mid-request
+    return registry.acquire() if registry is not None else nullcontext(static_index)
+
+# Restrict retrieval to the programs named in the question (e.g. "Algarve 2030")
+AUTO_SOURCE_FILTER = False
+
+# Cross-encoder reranking of the fused candidates, loaded and warmed before the first request (in launch)
+RERANK = False # True, "cascade" (rerank only ambiguous queries) or False
+
+# Answer parameters, also written to the query log so replays use the same ones
+ANSWER_PARAMS = {
+    "model": "gpt-4o-mini", "k": 20, "top_k": 5, "weight_dense": 0.6, "weight_sparse": 0.4,
+    "fusion": "weighted", "rerank": RERANK, "compress": None, "auto_filter": AUTO_SOURCE_FILTER, "use_cache": True,
+}
+
+# Per-question JSONL log for offline replay (python replay.py <log>), when QUERY_LOG is set
+query_log = QueryLog()
+
+# Concurrent chat events; async handlers only hold a thread during retrieval
+CONCURRENCY_LIMIT = 500
 
 USER_ID = "default_user" 
 
@@ -209,14 +247,15 @@ def handle_login(email, password):
         ""                               # clear password_input
     )
 
-def send_suggested_question(question, chat_hist, session_id, user_email):
+async def send_suggested_question(question, chat_hist, session_id, user_email):
     # call chat_stream and yield each result
-    for hist, inp in chat_stream(question, chat_hist, session_id, user_email):
+    async for hist, inp in chat_stream(question, chat_hist, session_id, user_email):
         yield hist, inp
 
 
 # ---------------- Chat function ----------------
-def chat_stream(user_query, chat_history, session_id, user_email):
+# Async generator: while waiting on the LLM a conversation holds no worker thread
+async def chat_stream(user_query, chat_history, session_id, user_email):
 
     if not user_query.strip():
         yield chat_history, ""
@@ -233,13 +272,25 @@ def chat_stream(user_query, chat_history, session_id, user_email):
     # Clear input immediately
     yield chat_history, ""
 
-    # Get bot response
-    bot_response, _ = answer(user_query, index, metadata, bm25)
-
-    # Stream character by character
-    for char in bot_response:
-        chat_history[assistant_index]['content'] += char
-        yield chat_history, ""
+    # Conversation memory is per user and session; anonymous questions are stateless
+    memory_id = f"{user_email}/{session_id}" if user_email and session_id else None
+    if memory_id and not memory.has(memory_id):
+        # e.g. a saved conversation reopened after a restart
+        saved = load_session(user_email, session_id)["messages"]
+        memory.load(memory_id, [(m["user"], m["assistant"]) for m in saved])
+
+    # Stream the bot response as the model generates it, one UI update per UI_UPDATE_MS
+    result = {}
+    timings = {} if query_log.enabled else None
+    with acquire_index() as snapshot:
+        stream = answer_stream_async(user_query, snapshot.index, snapshot.chunks, snapshot.bm25,
+                                     source_map=snapshot.source_map, session_id=memory_id, timings=timings,
+                                     result=result, **ANSWER_PARAMS)
+        async for delta in coalesce_async(stream, interval_ms=UI_UPDATE_MS):
+            chat_history[assistant_index]['content'] += delta
+            yield chat_history, ""
+    bot_response = result["answer"]
+    query_log.log(user_query, memory_id, ANSWER_PARAMS, timings, index_version=snapshot.index.version)
 
     # Save to JSON ONLY if logged in
     if user_email and session_id:
@@ -402,4 +453,23 @@ with gr.Blocks() as demo:
     )
 
 
-demo.launch() #share=True
\ No newline at end of file
+# ---------------- Launch ----------------
+# Threads, model sessions and servers are started here, not at import, so
+# serve.py can import this module once and fork workers from it
+def launch(port=None, metrics_port=None):
+    if RERANK:
+        warmup_reranker()
+    if registry is not None:
+        registry.watch()
+
+    # Per-stage latency histograms on http://localhost:<METRICS_PORT>/metrics (with TRACING=1)
+    metrics_port = metrics_port or os.getenv("METRICS_PORT")
+    if tracer.enabled and metrics_port:
+        tracer.serve(int(metrics_port))
+
+    demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT)
+    demo.launch(server_port=port) #share=True
+
+
+if __name__ == "__main__":
+    launch()
\ No newline at end of file
@@ -0,0 +1,202 @@
+# Libraries
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+import numpy as np
+
+
+LEXICAL_DIR = "bm25" # saved next to db.index
+TOKEN_PATTERN = r"\w+"
+# get_batch_scores over more than this share of the corpus scores every document
+# instead: one scatter per posting list beats a binary search per document
+BATCH_SCORES_MAX_FRACTION = 0.1
+
+
+def tokenize(text):
+    return re.findall(TOKEN_PATTERN, text.lower())
+
+
+def top_k_scores(scores: np.ndarray, k: int, doc_ids: np.ndarray | None = None):
+    """(ids, scores) of the k highest scores, best first, optionally among `doc_ids` only."""
+    ids = np.arange(len(scores)) if doc_ids is None else np.asarray(doc_ids, dtype=np.int64)
+    candidate_scores = scores[ids]
+
+    k = min(k, len(ids))
+    if k == 0:
+        return ids[:0], candidate_scores[:0]
+
+    part = np.argpartition(-candidate_scores, k - 1)[:k]
+    part = part[np.argsort(-candidate_scores[part], kind="stable")]
+    return ids[part], candidate_scores[part]
+
+
+class SparseBM25:
+    """
+    BM25 (Okapi) over a term-major CSR matrix whose entries are the
+    precomputed per-(term, document) BM25 weights, so a query only touches
+    the posting lists of its own terms.
+
+    Scores are identical to rank_bm25.BM25Okapi with the same k1, b and
+    epsilon: same IDF (negative IDFs floored to epsilon * average IDF), same
+    length normalization and the same per-term summation order.
+    """
+
+    def __init__(self, corpus: list[list[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.vocab = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(len(corpus), dtype=np.float64)
+
+        for d, tokens in enumerate(corpus):
+            doc_len[d] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(d)
+                tfs.append(tf)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float64)
+
+        self.corpus_size = len(corpus)
+        self.doc_len = doc_len
+        self.avgdl = doc_len.sum() / self.corpus_size
+        self.idf = self._calc_idf(np.bincount(term_ids, minlength=len(self.vocab)))
+
+        # BM25 weight of every posting, in the same operation order as rank_bm25
+        norm = self.k1 * (1 - self.b + self.b * doc_len[doc_ids] / self.avgdl)
+        weights = self.idf[term_ids] * (tfs * (self.k1 + 1) / (tfs + norm))
+
+        # Term-major CSR: postings of term t are indices/data[indptr[t]:indptr[t + 1]]
+        order = np.argsort(term_ids, kind="stable")
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)))])
+        self.indices = doc_ids[order]
+        self.data = weights[order]
+
+    def _calc_idf(self, doc_freq: np.ndarray) -> np.ndarray:
+        idf = [math.log(self.corpus_size - f + 0.5) - math.log(f + 0.5) for f in doc_freq.tolist()]
+        average_idf = sum(idf) / len(idf) if idf else 0.0 # sequential sum, as rank_bm25
+        idf = np.array(idf, dtype=np.float64)
+        idf[idf < 0] = self.epsilon * average_idf
+        return idf
+
+    # ---------------- Persistence ----------------
+    _ARRAYS = ("indptr", "indices", "data", "doc_len", "idf")
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        for name in self._ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+
+        with open(path / "vocab.json", "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+
+        with open(path / "params.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "epsilon": self.epsilon,
+                "corpus_size": self.corpus_size,
+                "avgdl": self.avgdl,
+                "token_pattern": TOKEN_PATTERN,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "SparseBM25":
+        """
+        Load a saved index. With `mmap`, postings are memory-mapped: loading
+        is near-instant and worker processes share the same physical pages.
+        """
+        path = Path(path)
+        with open(path / "params.json", "r", encoding="utf-8") as f:
+            params = json.load(f)
+
+        if params["token_pattern"] != TOKEN_PATTERN:
+            raise ValueError(f"{path} was built with token pattern {params['token_pattern']!r}, expected {TOKEN_PATTERN!r}")
+
+        bm25 = cls.__new__(cls)
+        bm25.k1, bm25.b, bm25.epsilon = params["k1"], params["b"], params["epsilon"]
+        bm25.corpus_size, bm25.avgdl = params["corpus_size"], params["avgdl"]
+
+        for name in cls._ARRAYS:
+            setattr(bm25, name, np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None))
+
+        with open(path / "vocab.json", "r", encoding="utf-8") as f:
+            bm25.vocab = json.load(f)
+
+        return bm25
+
+    # ---------------- Scoring ----------------
+    def get_scores(self, query: list[str]) -> np.ndarray:
+        """BM25 score of every document (drop-in for BM25Okapi.get_scores)."""
+        scores = np.zeros(self.corpus_size)
+        for term in query:
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            scores[self.indices[start:end]] += self.data[start:end]
+        return scores
+
+    def get_batch_scores(self, query: list[str], doc_ids) -> np.ndarray:
+        """
+        Scores for a subset of documents (drop-in for BM25Okapi.get_batch_scores),
+        same values as get_scores. Only `doc_ids` are scored: each posting list
+        (sorted by document) is matched against them by binary search, on
+        whichever side is shorter.
+        """
+        if len(doc_ids) > BATCH_SCORES_MAX_FRACTION * self.corpus_size:
+            return self.get_scores(query)[np.asarray(doc_ids, dtype=np.int64)]
+
+        ids, inverse = np.unique(np.asarray(doc_ids, dtype=np.int64), return_inverse=True)
+        ids = ids.astype(self.indices.dtype) # no int64 copy of the (memory-mapped) postings
+        scores = np.zeros(len(ids))
+        for term in query:
+            t = self.vocab.get(term)
+            if t is None or len(ids) == 0:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            postings, weights = self.indices[start:end], self.data[start:end]
+            if len(postings) > len(ids):
+                pos = np.minimum(np.searchsorted(postings, ids), len(postings) - 1)
+                hit = postings[pos] == ids
+                scores[hit] += weights[pos[hit]]
+            else:
+                pos = np.minimum(np.searchsorted(ids, postings), len(ids) - 1)
+                hit = ids[pos] == postings
+                scores[pos[hit]] += weights[hit]
+        return scores[inverse]
+
+    def top_k(self, query: list[str], k: int, doc_ids: np.ndarray | None = None):
+        """
+        (ids, scores) of the k best documents, best first, optionally among
+        `doc_ids` only. Uses argpartition, so cost is linear in the corpus
+        (in the posting lists and `doc_ids` when filtered).
+        """
+        if doc_ids is None or len(doc_ids) > BATCH_SCORES_MAX_FRACTION * self.corpus_size:
+            return top_k_scores(self.get_scores(query), k, doc_ids)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        top, scores = top_k_scores(self.get_batch_scores(query, doc_ids), k)
+        return doc_ids[top], scores
+
+
+def load_or_build(vector_dir: Path, metadata: list[dict], mmap: bool = True) -> SparseBM25:
+    """
+    The BM25 index 04_vectorize saved next to db.index (memory-mapped with
+    `mmap`), rebuilt from the chunks for older folders or when it does not
+    match them.
+    """
+    lexical_dir = Path(vector_dir) / LEXICAL_DIR
+    if lexical_dir.exists():
+        bm25 = SparseBM25.load(lexical_dir, mmap=mmap)
+        if bm25.corpus_size == len(metadata):
+            return bm25
+        print(f"[WARN] {lexical_dir} does not match db.json, rebuilding BM25")
+    return SparseBM25([tokenize(m["content"]) for m in metadata])
@@ -0,0 +1,139 @@
+# Libraries
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import tiktoken
+
+
+HISTORY_TOKEN_BUDGET = 2000 # history tokens per prompt, summary included
+SUMMARY_PREFIX = "Resumo da conversa anterior: "
+
+
+def count_tokens(encoding, message: dict) -> int:
+    return len(encoding.encode(message["content"])) + 4 # role and message framing
+
+
+class ConversationMemory:
+    """
+    Conversation history per session id, trimmed to a token budget.
+
+    The newest turns that fit in `token_budget` are kept. With a
+    `summarizer(summary, messages) -> str`, messages that fall out of the
+    budget are folded into a rolling summary (in a background thread, so
+    the answer is not delayed), which is sent ahead of the kept messages.
+    At most `max_sessions` sessions are held; the least recently used is
+    dropped first.
+    """
+
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET, encoding: str = "o200k_base",
+                 max_sessions: int = 10000, summarizer=None):
+        self.token_budget = token_budget
+        self.encoding_name = encoding
+        self.max_sessions = max_sessions
+        self.summarizer = summarizer
+
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary") if summarizer else None
+
+    @property
+    def encoding(self):
+        # Loaded on first use (tiktoken caches it): not needed to start the server
+        return tiktoken.get_encoding(self.encoding_name)
+
+    def _session(self, session_id) -> dict:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = {
+                "messages": [], # (message, tokens), oldest first
+                "turns": 0, # recorded turns, including those trimmed away
+                "summary": "",
+                "summary_tokens": 0,
+                "pending": [], # dropped messages not yet in the summary, oldest first
+                "summary_lock": threading.Lock(), # one summary update at a time per session
+            }
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _trim(self, session) -> list[dict]:
+        """Drop the oldest turns beyond the budget and return their messages."""
+        budget = self.token_budget - session["summary_tokens"]
+        messages = session["messages"]
+        used = 0
+        keep = len(messages)
+        # Whole (user, assistant) turns, so no answer is kept without its question
+        while keep >= 2:
+            tokens = messages[keep - 2][1] + messages[keep - 1][1]
+            if used + tokens > budget:
+                break
+            used += tokens
+            keep -= 2
+        dropped = [m for m, _ in messages[:keep]]
+        session["messages"] = session["messages"][keep:]
+        return dropped
+
+    def has(self, session_id) -> bool:
+        """Whether the session has history, even if trimmed down to the summary."""
+        with self._lock:
+            return session_id in self._sessions and self._sessions[session_id]["turns"] > 0
+
+    def history(self, session_id) -> list[dict]:
+        """Messages to send before the current question ([] for session_id=None)."""
+        if session_id is None:
+            return []
+        with self._lock:
+            session = self._session(session_id)
+            messages = [m for m, _ in session["messages"]]
+            if session["summary"]:
+                messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + session["summary"]})
+            return messages
+
+    def add(self, session_id, user_query: str, answer: str):
+        """Record a turn (no-op for session_id=None, i.e. stateless calls)."""
+        if session_id is None:
+            return
+        turn = [{"role": "user", "content": user_query}, {"role": "assistant", "content": answer}]
+
+        with self._lock:
+            session = self._session(session_id)
+            session["messages"].extend((m, count_tokens(self.encoding, m)) for m in turn)
+            session["turns"] += 1
+            dropped = self._trim(session)
+            if dropped and self.summarizer is not None:
+                session["pending"].extend(dropped)
+                self._summary_pool.submit(self._summarize, session)
+
+    def load(self, session_id, turns: list[tuple[str, str]]):
+        """Seed a session from saved (user, assistant) turns, keeping what fits the budget."""
+        with self._lock:
+            session = self._session(session_id)
+            session["messages"] = [
+                (m, count_tokens(self.encoding, m))
+                for user_query, answer in turns
+                for m in ({"role": "user", "content": user_query}, {"role": "assistant", "content": answer})
+            ]
+            session["turns"] = len(turns)
+            self._trim(session)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _summarize(self, session: dict):
+        # Pending messages are drained in order, whichever task gets the lock
+        with session["summary_lock"]:
+            while True:
+                with self._lock:
+                    dropped, session["pending"] = session["pending"], []
+                if not dropped:
+                    return
+
+                summary = self.summarizer(session["summary"], dropped)
+
+                with self._lock:
+                    session["summary"] = summary
+                    session["summary_tokens"] = count_tokens(self.encoding, {"content": SUMMARY_PREFIX + summary})
+                    # The summary's tokens count against the budget too
+                    session["pending"].extend(self._trim(session))
@@ -0,0 +1,82 @@
+# Libraries
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+# One JSONL line per answered question (query, session, retrieval parameters,
+# retrieved chunk ids and hybrid scores, stage timings), replayed offline by
+# replay.py. Enabled by setting QUERY_LOG (e.g. logs/queries.jsonl)
+QUERY_LOG = os.getenv("QUERY_LOG")
+QUERY_LOG_MAX_BYTES = 50 * 1024 * 1024 # rotate to <path>.1, <path>.2, ... past this size
+QUERY_LOG_BACKUPS = 5
+
+
+def session_hash(session_id) -> str | None:
+    # Sessions are keyed by user email; the log only needs to group turns
+    if session_id is None:
+        return None
+    return hashlib.sha1(str(session_id).encode("utf-8")).hexdigest()[:16]
+
+
+class QueryLog:
+    """Append-only JSONL query log with size-based rotation (no-op without a path)."""
+
+    def __init__(self, path: str | Path | None = QUERY_LOG, max_bytes: int = QUERY_LOG_MAX_BYTES,
+                 backups: int = QUERY_LOG_BACKUPS):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _rotate(self):
+        # <path>.N-1 -> <path>.N, ..., <path> -> <path>.1; the oldest falls off
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+    def log(self, query: str, session_id, params: dict, timings: dict | None, index_version: str | None = None):
+        if self.path is None:
+            return
+        timings = dict(timings or {})
+        line = {
+            "ts": time.time(),
+            "query": query,
+            "session": session_hash(session_id),
+            "params": params,
+            "index_version": index_version, # chunk ids below refer to this index
+            # Empty for answers served from the answer cache or stopped by moderation
+            "retrieved": [{"id": i, "score": score} for i, score in timings.pop("retrieved", [])],
+            "timings": {key: value for key, value in timings.items() if key.endswith("_ms")},
+        }
+        data = json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+        with self._lock:
+            if self.backups and self.path.exists() and self.path.stat().st_size + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+
+
+def read_log(path: str | Path) -> list[dict]:
+    """Entries of a query log and its rotated files, oldest first."""
+    path = Path(path)
+    rotated = [p for p in path.parent.glob(f"{path.name}.*") if p.suffix[1:].isdigit()]
+    files = sorted(rotated, key=lambda p: -int(p.suffix[1:])) + ([path] if path.exists() else [])
+
+    entries = []
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    return sorted(entries, key=lambda e: e["ts"])
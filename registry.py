@@ -0,0 +1,108 @@
+# Libraries
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from lexical_index import tokenize
+from snapshot import SNAPSHOT_ROOT, current_version, load_snapshot
+
+
+RELOAD_POLL_S = 10 # how often the watcher reads snapshots/CURRENT
+
+
+def warm(snapshot):
+    """One search per retriever, so the first request on a new snapshot does not pay the page faults."""
+    dim = snapshot.manifest.get("dim", snapshot.index.d)
+    q = np.random.default_rng(0).normal(size=(1, dim)).astype(np.float32)
+    snapshot.index.search(q / np.linalg.norm(q), 20)
+    snapshot.bm25.get_scores(tokenize(snapshot.chunks[0]["content"]))
+
+
+class IndexRegistry:
+    """
+    The snapshot served to new requests, swapped without a restart.
+
+    A watcher thread polls CURRENT; a new version is loaded and warmed in
+    that thread, then swapped in under the lock. Requests hold a snapshot
+    with `acquire()` for their whole duration: one that started on the old
+    version finishes on it, and a replaced snapshot is closed once its last
+    request releases it. A version that fails to load is logged and skipped
+    (the current one keeps serving) until CURRENT changes again.
+    """
+
+    def __init__(self, root: Path = SNAPSHOT_ROOT, poll_s: float = RELOAD_POLL_S):
+        self.root = Path(root)
+        self.poll_s = poll_s
+        self._lock = threading.Lock()
+        self._refs = {} # id(snapshot) -> requests holding it
+        self._retired = {} # id(snapshot) -> replaced snapshot still in use
+        self._failed = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self._snapshot = load_snapshot(self.root)
+
+    @property
+    def version(self) -> str:
+        return self._snapshot.version
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            snapshot = self._snapshot
+            self._refs[id(snapshot)] = self._refs.get(id(snapshot), 0) + 1
+        try:
+            yield snapshot
+        finally:
+            with self._lock:
+                self._refs[id(snapshot)] -= 1
+                released = self._refs[id(snapshot)] == 0 and self._retired.pop(id(snapshot), None) is not None
+                if self._refs[id(snapshot)] == 0:
+                    del self._refs[id(snapshot)]
+            if released:
+                self._close(snapshot)
+
+    def _close(self, snapshot):
+        snapshot.close()
+        print(f"[INFO] Released snapshot {snapshot.version}")
+
+    def reload(self) -> bool:
+        """Load and swap in the version CURRENT names, if new. Returns whether it swapped."""
+        version = current_version(self.root)
+        if version is None or version == self.version or version == self._failed:
+            return False
+
+        try:
+            snapshot = load_snapshot(self.root, version)
+            warm(snapshot)
+        except Exception as e:
+            self._failed = version
+            print(f"[WARN] Snapshot {version} failed to load, still serving {self.version}: {e}")
+            return False
+
+        with self._lock:
+            old, self._snapshot = self._snapshot, snapshot
+            in_use = self._refs.get(id(old), 0) > 0
+            if in_use:
+                self._retired[id(old)] = old
+        print(f"[INFO] Serving snapshot {version} (was {old.version})")
+        if not in_use:
+            self._close(old)
+        return True
+
+    def watch(self):
+        """Start the watcher thread (once per process: after fork in serve.py workers)."""
+        if self._watcher is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.poll_s):
+                try:
+                    self.reload()
+                except Exception as e: # the watcher must outlive any single failure
+                    print(f"[WARN] Snapshot reload failed: {e}")
+
+        self._watcher = threading.Thread(target=run, daemon=True, name="index-registry")
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
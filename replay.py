@@ -0,0 +1,198 @@
+# Libraries
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from query_log import read_log
+from snapshot import SNAPSHOT_ROOT, current_version, load_snapshot
+
+
+# Re-drives recorded traffic (query_log.py) through the retrieval pipeline, or
+# the full answer path with --llm, at the original pacing or `--speed` times
+# faster, and compares latencies and retrieved chunks with the recorded ones.
+# Parameters can be changed for the whole replay with --set, e.g. --set rerank=cascade
+
+DEFAULT_VECTOR_DIR = Path("data/05_vectorized/small/c400_0")
+RETRIEVAL_PARAMS = ("k", "top_k", "weight_dense", "weight_sparse", "rerank", "auto_filter", "fusion")
+ANSWER_PARAMS = RETRIEVAL_PARAMS + ("model", "compress", "use_cache")
+
+
+def parse_overrides(pairs: list[str]) -> dict:
+    """key=value pairs; values are read as JSON when they parse (5, 0.7, true, null)."""
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except json.JSONDecodeError:
+            overrides[key] = value
+    return overrides
+
+
+def start_stub(port: int) -> subprocess.Popen:
+    """Start stub_llm.py and wait until it accepts connections."""
+    process = subprocess.Popen([sys.executable, str(Path(__file__).with_name("stub_llm.py")), "--port", str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"stub_llm.py did not start on port {port}")
+
+
+# ---------------- Replay ----------------
+async def replay(entries: list[dict], run_one, speed: float = 1.0, concurrency: int = 64) -> list[dict]:
+    """
+    Start each entry at its recorded offset from the first one, divided by
+    `speed` (speed=0: back to back, only limited by `concurrency`). Turns of
+    the same session never overlap, so follow-ups see the earlier answers.
+    Returns {"entry", "timings", "lag_ms"} per entry, lag_ms being how late
+    the replayer started it.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    session_locks = {}
+    t0 = entries[0]["ts"]
+    wall_start = time.perf_counter()
+
+    async def one(entry):
+        scheduled = (entry["ts"] - t0) / speed if speed > 0 else 0.0
+        await asyncio.sleep(max(0.0, scheduled - (time.perf_counter() - wall_start)))
+
+        # Anonymous questions get a lock of their own
+        session_lock = session_locks.setdefault(entry["session"] or id(entry), asyncio.Lock())
+        async with session_lock, semaphore:
+            lag_ms = max(0.0, (time.perf_counter() - wall_start - scheduled) * 1000)
+            timings = {}
+            await run_one(entry, timings)
+        return {"entry": entry, "timings": timings, "lag_ms": lag_ms}
+
+    return await asyncio.gather(*(one(e) for e in entries))
+
+
+def overlap(recorded: list[dict], replayed: list) -> float | None:
+    """Share of the recorded chunk ids retrieved again (None when either side has none)."""
+    if not recorded or not replayed:
+        return None
+    ids = {r["id"] for r in recorded}
+    return len(ids & {i for i, _ in replayed}) / len(ids)
+
+
+def summarize(results: list[dict], wall_s: float, index_version: str | None = None):
+    from benchmark import print_table
+
+    stages = sorted({key for r in results for key in r["timings"] if key.endswith("_ms")})
+    rows = []
+    for stage in stages:
+        recorded = [r["entry"]["timings"][stage] for r in results if stage in r["entry"]["timings"]]
+        replayed = [r["timings"][stage] for r in results if stage in r["timings"]]
+        row = {"stage": stage[:-3], "n": len(replayed)}
+        for q in (50, 95, 99):
+            row[f"recorded_p{q}"] = f"{np.percentile(recorded, q):.1f}" if recorded else "-"
+            row[f"replay_p{q}"] = f"{np.percentile(replayed, q):.1f}"
+        rows.append(row)
+    print_table(rows)
+
+    # Chunk ids recorded on another index version do not name the same chunks
+    comparable = [r for r in results if r["entry"].get("index_version") in (None, index_version)]
+    overlaps = [o for o in (overlap(r["entry"]["retrieved"], r["timings"].get("retrieved")) for r in comparable)
+                if o is not None]
+    lags = [r["lag_ms"] for r in results]
+    print(f"\n[INFO] {len(results)} queries in {wall_s:.1f}s ({len(results) / wall_s:.1f}/s), "
+          f"start lag p95 {np.percentile(lags, 95):.0f} ms")
+    if overlaps:
+        print(f"[INFO] Recorded chunks retrieved again: {np.mean(overlaps):.1%} "
+              f"(identical sets for {np.mean([o == 1.0 for o in overlaps]):.1%} of {len(overlaps)} queries)")
+
+
+# ---------------- Entry Point ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query log against the retrieval pipeline")
+    parser.add_argument("query_logs", type=Path, nargs="+",
+                        help="QUERY_LOG path(s), e.g. one per serve.py worker; rotated files (.1, .2, ...) are included")
+    parser.add_argument("--vector-dir", type=Path, help=f"Default: the current snapshot, else {DEFAULT_VECTOR_DIR}")
+    parser.add_argument("--snapshot-root", type=Path, default=SNAPSHOT_ROOT)
+    parser.add_argument("--speed", type=float, default=1.0, help="Pacing multiplier (2 = twice as fast, 0 = no pacing)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Queries in flight at most")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE", help="Override recorded parameters")
+    parser.add_argument("--llm", action="store_true", help="Replay full answers, not only retrieval")
+    parser.add_argument("--stub", action="store_true", help="With --llm: answer with a local stub_llm.py")
+    parser.add_argument("--stub-port", type=int, default=8011)
+    parser.add_argument("--out", type=Path, help="Write the replayed timings and chunk ids as JSONL")
+    args = parser.parse_args()
+
+    entries = sorted((e for path in args.query_logs for e in read_log(path)), key=lambda e: e["ts"])[:args.limit]
+    if not entries:
+        sys.exit(f"[ERROR] No entries in {', '.join(map(str, args.query_logs))}")
+    overrides = parse_overrides(args.set)
+
+    # Imported here: loading chatbot creates the API clients
+    import chatbot
+    from openai import AsyncOpenAI
+    from source_filter import build_source_map
+
+    stub = None
+    if args.llm and args.stub:
+        # Only the chat completions go to the stub: embeddings must match the real index
+        stub = start_stub(args.stub_port)
+        chatbot.async_client = AsyncOpenAI(base_url=f"http://localhost:{args.stub_port}/v1", api_key="stub")
+
+    # The current snapshot, as the web app serves it, unless a vectorized folder is given
+    if args.vector_dir is None and current_version(args.snapshot_root):
+        snapshot = load_snapshot(args.snapshot_root)
+        index, metadata, bm25, source_map = snapshot.index, snapshot.chunks, snapshot.bm25, snapshot.source_map
+    else:
+        vector_dir = args.vector_dir or DEFAULT_VECTOR_DIR
+        index, metadata = chatbot.load_faiss_index(vector_dir)
+        bm25 = chatbot.load_bm25(vector_dir, metadata)
+        source_map = build_source_map(metadata)
+
+    other_versions = {e.get("index_version") for e in entries} - {index.version, None}
+    if other_versions:
+        print(f"[WARN] Log recorded on index version(s) {sorted(other_versions)}, replaying on {index.version}: "
+              "those queries are left out of the retrieved-chunk comparison")
+
+    async def run_one(entry, timings):
+        params = {**entry["params"], **overrides}
+        if args.llm:
+            session_id = f"replay/{entry['session']}" if entry["session"] else None
+            await chatbot.answer_async(entry["query"], index, metadata, bm25, source_map=source_map,
+                                       session_id=session_id, timings=timings,
+                                       **{key: params[key] for key in ANSWER_PARAMS if key in params})
+        else:
+            await asyncio.get_running_loop().run_in_executor(
+                chatbot.answer_pool,
+                lambda: chatbot.retrieve_hybrid(entry["query"], index, metadata, bm25, source_map=source_map,
+                                                timings=timings,
+                                                **{key: params[key] for key in RETRIEVAL_PARAMS if key in params}),
+            )
+
+    print(f"[INFO] Replaying {len(entries)} queries ({'answers' if args.llm else 'retrieval'}, speed {args.speed})")
+    try:
+        start = time.perf_counter()
+        results = asyncio.run(replay(entries, run_one, args.speed, args.concurrency))
+        wall_s = time.perf_counter() - start
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+    summarize(results, wall_s, index.version)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps({"query": r["entry"]["query"], "lag_ms": r["lag_ms"], **r["timings"]},
+                                   ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# Libraries
+import argparse
+import hashlib
+import importlib.util
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+ONNX_DIR = Path("models/reranker_onnx")
+ONNX_FILE = "model_quantized.onnx"
+ONNX_MAX_LENGTH = 256 # tokens per (query, chunk) pair when no max_length is given
+# The ONNX backend is opt-in: these are not in requirements.txt
+ONNX_INSTALL = "pip install onnxruntime optimum transformers"
+
+
+# ---------------- Backends ----------------
+class TorchCrossEncoder:
+    """
+    sentence-transformers CrossEncoder in PyTorch, full precision (previous
+    behaviour). max_length=None keeps the model's own limit (512 tokens for
+    the default model).
+    """
+    name = "torch"
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, max_length: int | None = None,
+                 threads: int | None = None):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+
+    def predict(self, pairs: list[tuple[str, str]]) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode():
+            return self.model.predict(pairs, convert_to_numpy=True, show_progress_bar=False)
+
+
+class OnnxCrossEncoder:
+    """
+    Cross-encoder exported to ONNX and int8-quantized (see `export_onnx`),
+    run with ONNX Runtime. Only the document side is truncated to
+    `max_length`, so long chunks never push the query out.
+    """
+    name = "onnx"
+
+    def __init__(self, model_dir: Path = ONNX_DIR, file_name: str = ONNX_FILE,
+                 max_length: int = ONNX_MAX_LENGTH, threads: int | None = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length, strategy="only_second")
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+
+        self.session = ort.InferenceSession(str(model_dir / file_name), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def predict(self, pairs: list[tuple[str, str]]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(pairs)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        return logits[:, 0]
+
+
+def export_onnx(model_name: str = DEFAULT_RERANK_MODEL, out_dir: Path = ONNX_DIR):
+    """Export the cross-encoder to ONNX and write a dynamically int8-quantized copy (ONNX_FILE)."""
+    if importlib.util.find_spec("optimum") is None or importlib.util.find_spec("onnxruntime") is None:
+        raise ImportError(f"Exporting the reranker to ONNX needs optional packages: {ONNX_INSTALL}")
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    out_dir = Path(out_dir)
+    model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+    model.save_pretrained(out_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(out_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(out_dir)
+    config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=out_dir, quantization_config=config)
+    print(f"[OK] Quantized reranker saved to {out_dir / ONNX_FILE}")
+
+
+# ---------------- Reranker ----------------
+def chunk_key(chunk: dict) -> str:
+    return chunk.get("fingerprint") or hashlib.md5(chunk["content"].encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """
+    Cross-encoder reranker with a (query hash, chunk fingerprint) -> score
+    LRU cache: only pairs not scored before are sent to the model.
+    """
+
+    def __init__(self, backend, cache_size: int = 50000):
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def warmup(self):
+        self.backend.predict([("aquecimento", "texto de aquecimento")])
+
+    def score(self, query: str, chunks: list[dict]) -> np.ndarray:
+        q_hash = hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+        keys = [(q_hash, chunk_key(c)) for c in chunks]
+        scores = np.empty(len(chunks), dtype=np.float32)
+
+        with self._lock:
+            missing = []
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+                else:
+                    missing.append(i)
+            self.hits += len(chunks) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            predicted = self.backend.predict([(query, chunks[i]["content"]) for i in missing])
+            scores[missing] = predicted
+
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    self._cache[keys[i]] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return scores
+
+    def rerank(self, query: str, chunks: list[dict], top_k: int = 5) -> list[dict]:
+        scores = self.score(query, chunks)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [chunks[i] for i in order]
+
+    def cascade(self, query: str, chunks: list[dict], prior_scores: np.ndarray, top_k: int = 5,
+                min_gap: float = 0.15, batch_size: int = 10) -> tuple[list[dict], int]:
+        """
+        Rerank only as deep as the query needs. `chunks` are ordered by
+        `prior_scores` (the hybrid scores, best first).
+
+        - If the prior gap between rank top_k and top_k + 1, relative to the
+          prior score range, is at least `min_gap`, the top_k set is taken as
+          is and nothing is scored.
+        - Otherwise chunks are scored in batches of `batch_size`, best prior
+          first, until adding a batch leaves the reranked top_k set unchanged
+          (or the candidates run out).
+
+        Returns (top_k chunks, number of chunks scored).
+        """
+        prior_scores = np.asarray(prior_scores, dtype=np.float64)
+        if len(chunks) <= top_k:
+            return self.rerank(query, chunks, top_k), len(chunks)
+
+        spread = prior_scores[0] - prior_scores[-1]
+        if spread > 0 and (prior_scores[top_k - 1] - prior_scores[top_k]) / spread >= min_gap:
+            return chunks[:top_k], 0
+
+        depth = min(max(batch_size, top_k + 1), len(chunks))
+        scores = self.score(query, chunks[:depth])
+        top = set(np.argsort(-scores, kind="stable")[:top_k].tolist())
+
+        while depth < len(chunks):
+            new_depth = min(depth + batch_size, len(chunks))
+            scores = np.concatenate([scores, self.score(query, chunks[depth:new_depth])])
+            depth = new_depth
+
+            new_top = set(np.argsort(-scores, kind="stable")[:top_k].tolist())
+            if new_top == top:
+                break
+            top = new_top
+
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [chunks[i] for i in order], depth
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def load_backend(name: str = "torch", max_length: int | None = None, threads: int | None = None):
+    """
+    PyTorch backend, or the ONNX int8 one (opt-in) when installed and exported
+    (python reranker.py export). max_length=None: the model's limit for
+    PyTorch, ONNX_MAX_LENGTH for ONNX.
+    """
+    if name == "onnx" and importlib.util.find_spec("onnxruntime") is None:
+        print(f"[WARN] onnxruntime is not installed, using the PyTorch reranker ({ONNX_INSTALL})")
+    elif name == "onnx" and not (ONNX_DIR / ONNX_FILE).exists():
+        print(f"[WARN] {ONNX_DIR / ONNX_FILE} not found, using the PyTorch reranker (run: python reranker.py export)")
+    elif name == "onnx":
+        return OnnxCrossEncoder(ONNX_DIR, max_length=max_length or ONNX_MAX_LENGTH, threads=threads)
+    return TorchCrossEncoder(max_length=max_length, threads=threads)
+
+
+# ---------------- Entry Point ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-encoder reranker utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Export and int8-quantize the cross-encoder to ONNX")
+    export.add_argument("--model", default=DEFAULT_RERANK_MODEL)
+    export.add_argument("--out-dir", type=Path, default=ONNX_DIR)
+
+    args = parser.parse_args()
+    export_onnx(args.model, args.out_dir)
@@ -0,0 +1,134 @@
+# Libraries
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+
+# Multi-worker serving: the web app (imports, snapshot handles, Gradio blocks)
+# is imported once, then forked into one process per worker, each
+# on its own port behind a load balancer with sticky sessions (Gradio's queue
+# and the conversation memory live in the worker). The snapshot is memory-mapped,
+# so its pages sit once in the page cache whatever the number of workers.
+
+WORKER_THREADS = 1 # FAISS/OpenMP threads per worker: the workers are the parallelism
+REPORT_DELAY_S = 15 # first memory report, once the workers are up
+
+
+def worker_log_path(path: str | None, worker: int) -> str | None:
+    # One query log per worker: rotation is not safe across processes
+    if not path:
+        return None
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.w{worker}{path.suffix}"))
+
+
+def memory_usage(pid: int) -> dict:
+    """RSS, PSS (shared pages split between the processes using them) and shared pages, in MB."""
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                usage[name] = int(value.split()[0]) / 1024
+    return {"rss_mb": usage["Rss"], "pss_mb": usage["Pss"],
+            "shared_mb": usage["Shared_Clean"] + usage["Shared_Dirty"]}
+
+
+def report_memory(workers: dict):
+    rows = []
+    for pid, worker in sorted(workers.items(), key=lambda kv: kv[1]):
+        try:
+            rows.append((worker, pid, memory_usage(pid)))
+        except OSError:
+            continue
+    for worker, pid, usage in rows:
+        print(f"[MEM] worker {worker} (pid {pid}): rss={usage['rss_mb']:.0f} MB, pss={usage['pss_mb']:.0f} MB, "
+              f"shared={usage['shared_mb']:.0f} MB")
+    if rows:
+        print(f"[MEM] total pss={sum(u['pss_mb'] for _, _, u in rows):.0f} MB for {len(rows)} workers")
+
+
+# ---------------- Workers ----------------
+def run_worker(app, worker: int, port: int, metrics_port: int | None):
+    import faiss
+    import chatbot
+    from query_log import QueryLog
+
+    # Per-process state that must not be inherited through fork
+    faiss.omp_set_num_threads(WORKER_THREADS)
+    chatbot.query_cache.after_fork()
+    app.query_log = QueryLog(worker_log_path(os.getenv("QUERY_LOG"), worker))
+
+    app.launch(port=port, metrics_port=metrics_port + worker if metrics_port else None)
+
+
+def start_worker(app, worker: int, args) -> int:
+    sys.stdout.flush() # or buffered output is printed again by the child
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            run_worker(app, worker, args.port + worker, args.metrics_port)
+        finally:
+            os._exit(1)
+    print(f"[INFO] Worker {worker} (pid {pid}) on port {args.port + worker}")
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the web app from several forked worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=7860, help="Port of worker 0; worker i listens on port + i")
+    parser.add_argument("--metrics-port", type=int, help="With TRACING=1: /metrics of worker i on this port + i")
+    parser.add_argument("--report-interval", type=float, default=0, help="Seconds between memory reports (0: once)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GRADIO_ANALYTICS_ENABLED", "False") # no background threads before fork
+
+    # Preload: everything imported and loaded here is shared copy-on-write by the workers
+    start = time.perf_counter()
+    import gradio_website as app
+    print(f"[INFO] Preloaded in {time.perf_counter() - start:.1f}s, forking {args.workers} workers")
+    # Objects allocated so far are left out of garbage collection, whose
+    # bookkeeping would otherwise write to (and copy) their pages in every worker
+    gc.freeze()
+
+    workers = {start_worker(app, i, args): i for i in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.time() + REPORT_DELAY_S
+    while workers:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            worker = workers.pop(pid)
+            if not stopping:
+                # Restarts are cheap: the preloaded state is forked again
+                print(f"[WARN] Worker {worker} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting")
+                time.sleep(1)
+                workers[start_worker(app, worker, args)] = worker
+            continue
+
+        if next_report is not None and time.time() >= next_report:
+            report_memory(workers)
+            next_report = time.time() + args.report_interval if args.report_interval > 0 else None
+        time.sleep(0.5)
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# Libraries
+import argparse
+import json
+import mmap
+import os
+import shutil
+import uuid
+from pathlib import Path
+import numpy as np
+import faiss
+from lexical_index import LEXICAL_DIR, SparseBM25, tokenize
+from source_filter import build_source_map
+from vector_index import INDEX_FILE, MANIFEST_FILE, VECTORS_FILE, load_index, read_manifest, write_manifest
+
+
+# One directory per build under SNAPSHOT_ROOT, named by its manifest version:
+#   db.index, db_vectors.npy, bm25/, chunks.jsonl + chunk_offsets.npy, sources.json, manifest.json
+# CURRENT holds the version served. Everything large is memory-mapped on load,
+# so startup does not depend on corpus size (no db.json parse, no BM25 build)
+SNAPSHOT_ROOT = Path("snapshots")
+CURRENT_FILE = "CURRENT"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "chunk_offsets.npy"
+SOURCES_FILE = "sources.json"
+
+
+# ---------------- Chunk store ----------------
+class ChunkStore:
+    """
+    Read-only chunk metadata (source_file, url, chunk_id, fingerprint,
+    content) indexed like the db.json list: one JSON line per chunk in a
+    memory-mapped file, located by a byte-offset array. Each access parses
+    a fresh dict, so callers cannot alter the store.
+    """
+
+    def __init__(self, path: Path):
+        path = Path(path)
+        self.offsets = np.load(path / OFFSETS_FILE, mmap_mode="r")
+        with open(path / CHUNKS_FILE, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"chunk {i} out of range")
+        return json.loads(self._data[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self._data.close()
+
+    @staticmethod
+    def write(path: Path, metadata: list[dict]):
+        offsets = [0]
+        with open(Path(path) / CHUNKS_FILE, "wb") as f:
+            for chunk in metadata:
+                line = (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(Path(path) / OFFSETS_FILE, np.array(offsets, dtype=np.int64))
+
+
+# ---------------- Load ----------------
+class Snapshot:
+    """Everything retrieval needs from one snapshot directory."""
+
+    def __init__(self, path: Path, mmap: bool = True):
+        self.path = Path(path)
+        # Manifest, FAISS index (codes memory-mapped with `mmap`) and memory-mapped vectors
+        self.index = load_index(self.path, mmap=mmap)
+        self.chunks = ChunkStore(self.path)
+        self.bm25 = SparseBM25.load(self.path / LEXICAL_DIR)
+
+        with open(self.path / SOURCES_FILE, "r", encoding="utf-8") as f:
+            self.source_map = {source: np.array(ids, dtype=np.int64) for source, ids in json.load(f).items()}
+
+        if not (self.index.ntotal == len(self.chunks) == self.bm25.corpus_size):
+            raise ValueError(f"{self.path}: index ({self.index.ntotal}), chunks ({len(self.chunks)}) "
+                             f"and BM25 ({self.bm25.corpus_size}) sizes differ")
+
+    @property
+    def version(self) -> str:
+        return self.index.version
+
+    @property
+    def manifest(self) -> dict:
+        return self.index.manifest
+
+    def close(self):
+        # Only the chunk map is closed explicitly: the FAISS index and numpy maps are freed
+        # with their last reference (a retrieval stage abandoned by a cache hit may hold one)
+        self.chunks.close()
+
+
+def current_version(root: Path = SNAPSHOT_ROOT) -> str | None:
+    path = Path(root) / CURRENT_FILE
+    if not path.exists():
+        return None
+    return path.read_text(encoding="utf-8").strip()
+
+
+def set_current(version: str, root: Path = SNAPSHOT_ROOT):
+    # Written aside and renamed, so readers never see a half-written pointer
+    root = Path(root)
+    if not (root / version / MANIFEST_FILE).exists():
+        raise FileNotFoundError(f"No snapshot {root / version}")
+    tmp = root / f".{CURRENT_FILE}.{uuid.uuid4().hex}"
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, root / CURRENT_FILE)
+
+
+def list_snapshots(root: Path = SNAPSHOT_ROOT) -> list[Path]:
+    """Snapshot directories under `root`, oldest first."""
+    def order(path):
+        base, _, n = path.name.partition("-")
+        return base, int(n) if n.isdigit() else 1
+
+    return sorted((p for p in Path(root).glob("*") if (p / MANIFEST_FILE).exists()), key=order)
+
+
+def prune(keep: int, root: Path = SNAPSHOT_ROOT) -> list[Path]:
+    """Delete all but the `keep` newest snapshots; the current one is always kept."""
+    current = current_version(root)
+    snapshots = [p for p in list_snapshots(root) if p.name != current]
+    # The current snapshot counts towards `keep`
+    others_kept = max(0, keep - (current is not None))
+    removed = snapshots[:max(0, len(snapshots) - others_kept)]
+    for path in removed:
+        shutil.rmtree(path)
+    return removed
+
+
+def load_snapshot(root: Path = SNAPSHOT_ROOT, version: str | None = None, mmap: bool = True) -> Snapshot:
+    """The given snapshot version, or the one CURRENT points to."""
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No {CURRENT_FILE} in {root} (build one with 04_vectorize or snapshot.py build)")
+    return Snapshot(Path(root) / version, mmap=mmap)
+
+
+# ---------------- Build ----------------
+def write_snapshot(index, metadata: list[dict], vectors: np.ndarray, bm25: SparseBM25, manifest_fields: dict,
+                   root: Path = SNAPSHOT_ROOT, make_current: bool = True) -> Path:
+    """
+    Write a complete snapshot and (by default) point CURRENT at it. Files go
+    to a hidden directory first, renamed to the version once complete.
+    """
+    root = Path(root)
+    tmp = root / f".build-{uuid.uuid4().hex}"
+    tmp.mkdir(parents=True)
+
+    faiss.write_index(index, str(tmp / INDEX_FILE))
+    np.save(tmp / VECTORS_FILE, np.asarray(vectors, dtype=np.float32))
+    bm25.save(tmp / LEXICAL_DIR)
+    ChunkStore.write(tmp, metadata)
+    with open(tmp / SOURCES_FILE, "w", encoding="utf-8") as f:
+        json.dump({source: ids.tolist() for source, ids in build_source_map(metadata).items()}, f, ensure_ascii=False)
+
+    manifest = write_manifest(tmp, **manifest_fields)
+    # Versions are timestamps to the second: a build in the same second gets a -2, -3, ... suffix
+    version, n = manifest["version"], 1
+    while True:
+        path = root / version
+        try:
+            os.rename(tmp, path) # fails if the directory exists, even for a concurrent build
+            break
+        except OSError:
+            if not path.exists():
+                raise
+            n += 1
+            version = f"{manifest['version']}-{n}"
+            write_manifest(tmp, **{**manifest_fields, "version": version, "created_at": manifest["created_at"]})
+    if make_current:
+        set_current(version, root)
+    print(f"[OK] Snapshot {path} ({len(metadata)} chunks)")
+    return path
+
+
+def snapshot_from_vector_dir(vector_dir: Path, root: Path = SNAPSHOT_ROOT, make_current: bool = True) -> Path:
+    """Snapshot an existing 04_vectorize output folder without re-embedding."""
+    vector_dir = Path(vector_dir)
+    with open(vector_dir / "db.json", "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+
+    vectors = np.load(vector_dir / VECTORS_FILE) if (vector_dir / VECTORS_FILE).exists() else None
+    if vectors is None: # older builds kept the vectors inside db.json
+        vectors = np.array([m["chunk_vector"] for m in metadata], dtype=np.float32)
+    for m in metadata:
+        m.pop("chunk_vector", None)
+
+    lexical_dir = vector_dir / LEXICAL_DIR
+    if lexical_dir.exists():
+        bm25 = SparseBM25.load(lexical_dir, mmap=False)
+    else:
+        bm25 = SparseBM25([tokenize(m["content"]) for m in metadata])
+
+    fields = {k: v for k, v in read_manifest(vector_dir).items() if k not in ("version", "created_at")}
+    return write_snapshot(faiss.read_index(str(vector_dir / INDEX_FILE)), metadata, vectors, bm25, fields,
+                          root, make_current)
+
+
+# ---------------- Entry Point ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval snapshots")
+    parser.add_argument("--root", type=Path, default=SNAPSHOT_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Snapshot an existing vectorized folder")
+    build.add_argument("vector_dir", type=Path)
+    build.add_argument("--no-current", action="store_true", help="Do not point CURRENT at the new snapshot")
+
+    sub.add_parser("list", help="List snapshots, marking the current one")
+
+    use = sub.add_parser("use", help="Point CURRENT at a snapshot (e.g. to roll back)")
+    use.add_argument("version")
+
+    prune_cmd = sub.add_parser("prune", help="Delete old snapshots, keeping the current one")
+    prune_cmd.add_argument("--keep", type=int, required=True, help="Snapshots to keep, including the current one")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        snapshot_from_vector_dir(args.vector_dir, args.root, make_current=not args.no_current)
+    elif args.command == "list":
+        current = current_version(args.root)
+        for path in list_snapshots(args.root):
+            manifest = read_manifest(path)
+            print(f"{'*' if path.name == current else ' '} {path.name}  {manifest.get('index_spec')}  "
+                  f"ntotal={manifest.get('ntotal')}  {manifest.get('created_at')}")
+    elif args.command == "use":
+        set_current(args.version, args.root)
+        print(f"[OK] {args.root / CURRENT_FILE} -> {args.version}")
+    else:
+        removed = prune(args.keep, args.root)
+        for path in removed:
+            print(f"[INFO] Removed {path}")
+        print(f"[OK] {len(removed)} snapshot(s) removed, {len(list_snapshots(args.root))} kept")
@@ -0,0 +1,45 @@
+# Libraries
+import re
+import unicodedata
+import numpy as np
+
+
+# Extra names users write for a source, keyed by source_file (normalized form)
+SOURCE_ALIASES = {
+    "portugal2030": ["pt2030", "portugal2030"],
+}
+
+
+# ---------------- Source map ----------------
+def build_source_map(metadata: list[dict]) -> dict[str, np.ndarray]:
+    """source_file -> sorted array of chunk ids, built once at load time."""
+    groups = {}
+    for i, chunk in enumerate(metadata):
+        groups.setdefault(chunk["source_file"], []).append(i)
+    return {source: np.array(ids, dtype=np.int64) for source, ids in groups.items()}
+
+
+def source_ids(source_map: dict[str, np.ndarray], sources: list[str]) -> np.ndarray:
+    unknown = [s for s in sources if s not in source_map]
+    if unknown:
+        raise ValueError(f"Unknown source(s): {unknown}")
+    return np.unique(np.concatenate([source_map[s] for s in sources]))
+
+
+# ---------------- Query-side detection ----------------
+def normalize(text: str) -> str:
+    # "Programa Algarve 2030" -> "programaalgarve2030"
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]", "", text)
+
+
+def detect_sources(query: str, sources: list[str]) -> list[str]:
+    """Sources explicitly named in the query (e.g. "Algarve 2030" -> algarve2030)."""
+    q = normalize(query)
+    found = []
+    for source in sources:
+        names = SOURCE_ALIASES.get(normalize(source), [normalize(source)])
+        if any(name in q for name in names):
+            found.append(source)
+    return found
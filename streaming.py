@@ -0,0 +1,127 @@
+# Libraries
+import asyncio
+import math
+import threading
+import time
+
+
+UI_UPDATE_MS = 40 # how often a streaming answer is pushed to the browser
+
+
+# Both versions read `stream` concurrently (thread / task) into a shared list, and
+# the consumer only wakes once per flush: the first delta, `max_deltas` pending,
+# the end of the stream, or `interval_ms` after the previous flush. Pending
+# deltas are so flushed on time even while the model stalls between two deltas.
+
+def coalesce(stream, interval_ms: float = UI_UPDATE_MS, max_deltas: int | None = None):
+    """
+    Batch the text deltas of `stream` (e.g. chatbot.answer_stream) into
+    fewer, larger pieces: pending deltas are flushed when `interval_ms` has
+    passed since the last flush or, if given, once `max_deltas` are pending.
+    The first delta is flushed right away, so time to first token is not
+    delayed, and the stream's return value is passed through.
+    """
+    cond = threading.Condition()
+    state = {"pending": [], "finished": False, "error": None, "value": None, "stop": False}
+
+    def full():
+        return bool(max_deltas and len(state["pending"]) >= max_deltas)
+
+    def read():
+        # An explicit next() loop keeps the generator's return value
+        try:
+            while not state["stop"]:
+                delta = next(stream)
+                with cond:
+                    state["pending"].append(delta)
+                    if len(state["pending"]) == 1 or full():
+                        cond.notify()
+        except StopIteration as done:
+            state["value"] = done.value
+        except BaseException as e:
+            state["error"] = e
+        finally:
+            if state["stop"]:
+                stream.close()
+            with cond:
+                state["finished"] = True
+                cond.notify()
+
+    threading.Thread(target=read, daemon=True, name="coalesce").start()
+
+    last_flush = None
+    try:
+        while True:
+            with cond:
+                cond.wait_for(lambda: state["pending"] or state["finished"])
+                if last_flush is not None and not math.isinf(interval_ms):
+                    # Wait out the interval unless the batch fills up or the stream ends
+                    remaining = last_flush + interval_ms / 1000 - time.perf_counter()
+                    if remaining > 0:
+                        cond.wait_for(lambda: state["finished"] or full(), timeout=remaining)
+                elif last_flush is not None:
+                    cond.wait_for(lambda: state["finished"] or full())
+                batch, state["pending"] = state["pending"], []
+                finished, error = state["finished"], state["error"]
+
+            if error is not None:
+                raise error
+            if batch:
+                yield "".join(batch)
+                last_flush = time.perf_counter()
+            if finished:
+                return state["value"]
+    finally:
+        state["stop"] = True
+
+
+async def coalesce_async(stream, interval_ms: float = UI_UPDATE_MS, max_deltas: int | None = None):
+    """`coalesce` for async generators (e.g. chatbot.answer_stream_async)."""
+    ready = asyncio.Event()
+    pending = []
+    state = {"finished": False, "error": None}
+
+    def full():
+        return bool(max_deltas and len(pending) >= max_deltas)
+
+    async def read():
+        try:
+            async for delta in stream:
+                pending.append(delta)
+                if len(pending) == 1 or full():
+                    ready.set()
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["finished"] = True
+            ready.set()
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.ensure_future(read())
+    last_flush = None
+    try:
+        while True:
+            if not pending and not state["finished"]:
+                ready.clear()
+                await ready.wait()
+            if last_flush is not None and not state["finished"] and not full():
+                # Wait out the interval unless the batch fills up or the stream ends
+                remaining = math.inf if math.isinf(interval_ms) else last_flush + interval_ms / 1000 - time.perf_counter()
+                if remaining > 0:
+                    ready.clear()
+                    timer = None if math.isinf(remaining) else loop.call_later(remaining, ready.set)
+                    await ready.wait()
+                    if timer is not None:
+                        timer.cancel()
+
+            if state["error"] is not None:
+                raise state["error"]
+            if pending:
+                batch = "".join(pending)
+                pending.clear()
+                yield batch
+                last_flush = time.perf_counter()
+            if state["finished"] and not pending:
+                return
+    finally:
+        reader.cancel()
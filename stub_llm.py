@@ -0,0 +1,141 @@
+# Libraries
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+import numpy as np
+from aiohttp import web
+
+
+# Local stand-in for the OpenAI API, for load tests without cost or rate limits:
+# /v1/chat/completions (JSON or SSE stream), /v1/embeddings and /v1/moderations.
+# Point the chatbot at it with OPENAI_BASE_URL=http://localhost:8001/v1
+
+CHARS_PER_TOKEN = 4 # rough token count of the stub
+# Prefix caching as the provider applies it: prompts of 1024+ tokens, matched in 128-token steps
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+CACHE_MAX_PREFIXES = 100_000
+
+
+def text_vector(text: str, dim: int) -> list[float]:
+    # Deterministic per text, so repeated questions embed identically
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).normal(size=dim)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+class PrefixCache:
+    """Cached-token counts for a stream of prompts, keyed by hashes of their prefixes."""
+
+    def __init__(self, max_prefixes: int = CACHE_MAX_PREFIXES):
+        self.max_prefixes = max_prefixes
+        self._prefixes = OrderedDict()
+
+    def lookup(self, messages: list[dict]) -> int:
+        """Tokens of the longest prefix seen before (0 below CACHE_MIN_TOKENS); caches this prompt's prefixes."""
+        text = "".join(f"{m['role']}\n{m['content']}\n" for m in messages)
+        step = CACHE_STEP_TOKENS * CHARS_PER_TOKEN
+        h = hashlib.sha1()
+        cached, start = 0, 0
+        for end in range(CACHE_MIN_TOKENS * CHARS_PER_TOKEN, len(text) + 1, step):
+            h.update(text[start:end].encode("utf-8"))
+            start = end
+            key = h.digest()
+            if key in self._prefixes:
+                self._prefixes.move_to_end(key)
+                cached = end // CHARS_PER_TOKEN
+            else:
+                self._prefixes[key] = None
+        while len(self._prefixes) > self.max_prefixes:
+            self._prefixes.popitem(last=False)
+        return cached
+
+
+def make_app(ttft_ms: float, token_ms: float, n_tokens: int, embed_ms: float, dim: int) -> web.Application:
+    tokens = [f"tok{i % 10} " for i in range(n_tokens)]
+    prefix_cache = PrefixCache()
+
+    async def chat_completions(request):
+        body = await request.json()
+        created = int(time.time())
+        base = {"id": "chatcmpl-stub", "created": created, "model": body.get("model", "stub")}
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // CHARS_PER_TOKEN
+        cached_tokens = min(prefix_cache.lookup(body["messages"]), prompt_tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens,
+                 "total_tokens": prompt_tokens + n_tokens, "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+        await asyncio.sleep(ttft_ms / 1000)
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_ms * n_tokens / 1000)
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send({"role": "assistant", "content": ""})
+        for token in tokens:
+            await send({"content": token})
+            await asyncio.sleep(token_ms / 1000)
+        await send({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(embed_ms / 1000)
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i, "embedding": text_vector(t, body.get("dimensions") or dim)}
+                     for i, t in enumerate(texts)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def moderations(request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return web.json_response({
+            "id": "modr-stub",
+            "model": "stub",
+            "results": [{"flagged": False, "categories": {}, "category_scores": {}} for _ in texts],
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/embeddings", embeddings)
+    app.router.add_post("/v1/moderations", moderations)
+    return app
+
+
+# ---------------- Entry Point ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible server for load tests")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft-ms", type=float, default=400, help="Delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=20, help="Delay between tokens")
+    parser.add_argument("--tokens", type=int, default=300, help="Tokens per answer")
+    parser.add_argument("--embed-ms", type=float, default=80)
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding size when the request sets no dimensions")
+    args = parser.parse_args()
+
+    web.run_app(make_app(args.ttft_ms, args.token_ms, args.tokens, args.embed_ms, args.dim), port=args.port)
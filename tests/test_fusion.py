@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from fusion import align_scores, fuse, reciprocal_ranks, union_candidates
+
+
+def test_union_candidates_ignores_faiss_padding():
+    # FAISS pads with -1 when fewer than k results pass the filter
+    ids = union_candidates(np.array([7, 3, -1, -1]), np.array([3, 9]))
+    assert ids.tolist() == [3, 7, 9]
+
+
+def test_union_candidates_empty_sparse():
+    ids = union_candidates(np.array([5, 2]), np.array([], dtype=np.int64))
+    assert ids.tolist() == [2, 5]
+
+
+def test_union_candidates_all_empty():
+    assert len(union_candidates(np.array([-1, -1]), np.array([], dtype=np.int64))) == 0
+
+
+def test_align_scores_nan_for_missing():
+    candidates = np.array([2, 5, 9])
+    aligned = align_scores(candidates, np.array([9, 2, -1]), np.array([0.9, 0.4, -3.4e38]))
+    assert aligned[0] == 0.4 and aligned[2] == 0.9
+    assert np.isnan(aligned[1]) # BM25-only candidate: no dense score
+
+
+def test_reciprocal_ranks_order():
+    ranks = reciprocal_ranks(np.array([0.2, np.nan, 0.9, 0.5]), rrf_k=60)
+    assert ranks[2] == pytest.approx(1 / 61)
+    assert ranks[3] == pytest.approx(1 / 62)
+    assert ranks[0] == pytest.approx(1 / 63)
+    assert ranks[1] == 0.0
+
+
+def test_reciprocal_ranks_ties_keep_candidate_order():
+    ranks = reciprocal_ranks(np.array([0.5, 0.5, 0.7]), rrf_k=60)
+    assert ranks[2] > ranks[0] > ranks[1]
+
+
+def test_weighted_nan_dense_for_bm25_only_candidate():
+    candidates = np.array([1, 2, 3])
+    dense = np.array([0.9, 0.5, np.nan]) # 3 came from BM25 only
+    sparse = np.array([np.nan, 1.0, 8.0])
+    ids, fused = fuse(candidates, dense, sparse, "weighted", 0.6, 0.4)
+    assert not np.isnan(fused).any()
+    # 3: 0.6 * 0 + 0.4 * 1; 1: 0.6 * 1 + 0.4 * 0; 2: 0.6 * 0 + 0.4 * 0
+    assert ids.tolist() == [1, 3, 2]
+    assert fused == pytest.approx([0.6, 0.4, 0.0], abs=1e-6)
+
+
+def test_weighted_empty_sparse():
+    candidates = np.array([4, 8])
+    dense = np.array([0.2, 0.8])
+    sparse = align_scores(candidates, np.array([], dtype=np.int64), np.array([]))
+    ids, fused = fuse(candidates, dense, sparse, "weighted", 0.6, 0.4)
+    assert ids.tolist() == [8, 4]
+    assert fused[0] == pytest.approx(0.6, abs=1e-6)
+
+
+def test_ties_keep_lower_id_first():
+    candidates = np.array([3, 5, 8])
+    dense = np.array([0.5, 0.5, 0.5])
+    sparse = np.array([1.0, 1.0, 1.0])
+    ids, fused = fuse(candidates, dense, sparse, "weighted")
+    assert ids.tolist() == [3, 5, 8]
+    assert fused[0] == fused[2]
+    # RRF on tied scores: ranks follow candidate (id) order
+    ids, _ = fuse(candidates, dense, sparse, "rrf")
+    assert ids.tolist() == [3, 5, 8]
+
+
+def test_rrf_rank_order():
+    candidates = np.array([10, 20, 30])
+    dense = np.array([0.9, 0.8, np.nan]) # dense ranks: 10, 20
+    sparse = np.array([np.nan, 5.0, 7.0]) # sparse ranks: 30, 20
+    ids, fused = fuse(candidates, dense, sparse, "rrf", 0.5, 0.5, rrf_k=60)
+    # 20 appears in both lists and wins; 10 and 30 are both first in one list
+    assert ids.tolist() == [20, 10, 30]
+    assert fused[0] == pytest.approx(0.5 / 62 + 0.5 / 62)
+    assert fused[1] == pytest.approx(fused[2])
+
+
+@pytest.mark.parametrize("method", ["weighted", "rrf"])
+def test_weight_one_follows_a_single_retriever(method):
+    candidates = np.array([1, 2, 3])
+    dense = np.array([0.1, 0.9, 0.5])
+    sparse = np.array([9.0, 1.0, np.nan])
+    ids, _ = fuse(candidates, dense, sparse, method, weight_dense=1.0, weight_sparse=0.0)
+    assert ids.tolist() == [2, 3, 1]
+    ids, _ = fuse(candidates, dense, sparse, method, weight_dense=0.0, weight_sparse=1.0)
+    assert ids[:2].tolist() == [1, 2]
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        fuse(np.array([1]), np.array([0.1]), np.array([0.1]), "max")
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+import pytest
+import memory
+from memory import ConversationMemory, SUMMARY_PREFIX
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # One token per word, so the tests do not need the tiktoken download
+    monkeypatch.setattr(memory.tiktoken, "get_encoding", lambda name: SimpleNamespace(encode=str.split))
+
+
+def test_trim_keeps_whole_turns():
+    m = ConversationMemory(token_budget=30)
+    m.add("s", "q1", "a1")
+    m.add("s", "q2 " * 10, "a2")
+    m.add("s", "q3", "a3")
+    roles = [message["role"] for message in m.history("s")]
+    # q1/a1 are dropped together, never leaving a1 without its question
+    assert roles == ["user", "assistant", "user", "assistant"]
+    assert m.history("s")[0]["content"].startswith("q2")
+
+
+def test_summary_only_session_has_history():
+    m = ConversationMemory(token_budget=40, summarizer=lambda summary, messages: "resumo")
+    m.add("s", "q1 " * 30, "a1 " * 30) # a single turn larger than the budget
+    m._summary_pool.shutdown(wait=True)
+    assert m.history("s") == [{"role": "system", "content": SUMMARY_PREFIX + "resumo"}]
+    assert m.has("s")
+    assert not m.has("other")
@@ -0,0 +1,30 @@
+import numpy as np
+import faiss
+from lexical_index import SparseBM25, tokenize
+from snapshot import current_version, list_snapshots, load_snapshot, prune, set_current, write_snapshot
+
+
+def build(root, n=1):
+    metadata = [{"source_file": "a.md", "url": "", "chunk_id": i, "content": f"chunk {i} text"} for i in range(4)]
+    vectors = np.random.default_rng(0).random((4, 8), dtype=np.float32)
+    index = faiss.IndexFlatIP(8)
+    index.add(vectors)
+    bm25 = SparseBM25([tokenize(m["content"]) for m in metadata])
+    return [write_snapshot(index, metadata, vectors, bm25, {"index_spec": "Flat"}, root) for _ in range(n)]
+
+
+def test_same_second_builds_get_unique_versions(tmp_path):
+    paths = build(tmp_path, 3)
+    assert len({p.name for p in paths}) == 3
+    assert list_snapshots(tmp_path) == paths
+    # The manifest version names the directory
+    assert load_snapshot(tmp_path).version == paths[-1].name == current_version(tmp_path)
+
+
+def test_prune_keeps_current(tmp_path):
+    paths = build(tmp_path, 4)
+    set_current(paths[0].name, tmp_path)
+    removed = prune(2, tmp_path)
+    assert removed == paths[1:3]
+    assert list_snapshots(tmp_path) == [paths[0], paths[3]]
+    assert prune(2, tmp_path) == []
@@ -0,0 +1,26 @@
+import faiss
+import pytest
+from vector_index import storage_spec
+
+
+DIM = 64
+SPECS = ["Flat", "IVF1024,Flat", "IVF1024,PQ64", "HNSW32", "HNSW32,Flat", "OPQ16,IVF256,PQ16"]
+
+
+@pytest.mark.parametrize("spec", SPECS)
+@pytest.mark.parametrize("storage", ["float32", "float16", "int8", "pq"])
+def test_storage_spec_builds(spec, storage):
+    faiss.index_factory(DIM, storage_spec(spec, storage, DIM), faiss.METRIC_INNER_PRODUCT)
+
+
+def test_storage_spec_float32_unchanged():
+    for spec in SPECS:
+        assert storage_spec(spec, "float32", DIM) == spec
+
+
+def test_storage_spec_replaces_codec():
+    assert storage_spec("IVF1024,PQ64", "int8", DIM) == "IVF1024,SQ8"
+    assert storage_spec("OPQ16,IVF256,PQ16", "float16", DIM) == "OPQ16,IVF256,SQfp16"
+    assert storage_spec("HNSW32", "int8", DIM) == "HNSW32,SQ8"
+    assert storage_spec("Flat", "pq", DIM) == "PQ16"
+    assert storage_spec("IVF1024,Flat", "pq", DIM, pq_m=8) == "IVF1024,PQ8"
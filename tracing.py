@@ -0,0 +1,168 @@
+# Libraries
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+
+
+# Stage timings of a request live in a plain dict (the `timings` argument of
+# chatbot.answer & co.): record() is a no-op when it is None, so with tracing
+# disabled the instrumentation costs one `is None` check per stage
+TRACING_ENABLED = os.getenv("TRACING", "0") == "1"
+TRACE_LOG = os.getenv("TRACE_LOG") # JSONL, one line per traced request
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+TOKEN_COUNTERS = ("prompt_tokens", "cached_tokens")
+
+
+# ---------------- Spans ----------------
+def record(timings, name, start):
+    """End a span: milliseconds since `start` (time.perf_counter) stored as timings[name]."""
+    if timings is not None:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+@contextmanager
+def span(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(timings, name, start)
+
+
+# ---------------- Metrics ----------------
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Tracer:
+    """Per-stage latency histograms, token counters and the JSONL trace log."""
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, log_path: str | None = TRACE_LOG):
+        self.enabled = enabled
+        self.log_path = Path(log_path) if log_path else None
+        self._lock = threading.Lock()
+        self.histograms = {} # (trace name, stage) -> Histogram
+        self.counters = {} # (trace name, counter) -> total
+
+    def start(self, timings):
+        """The dict to record into: the caller's, a new one when tracing, else None."""
+        if timings is None and self.enabled:
+            return {}
+        return timings
+
+    def finish(self, name: str, timings, **attrs):
+        """Fold one request's timings into the metrics and append it to the trace log."""
+        if not self.enabled or timings is None:
+            return
+        # Snapshot: a stage abandoned by a cache hit or moderation may still be writing
+        timings = dict(timings)
+
+        with self._lock:
+            for key, value in timings.items():
+                if key.endswith("_ms"):
+                    hist = self.histograms.setdefault((name, key[:-3]), Histogram())
+                    hist.observe(value)
+                elif key in TOKEN_COUNTERS:
+                    self.counters[(name, key)] = self.counters.get((name, key), 0) + value
+
+            if self.log_path is not None:
+                line = {"trace_id": uuid.uuid4().hex, "name": name, "ts": time.time(), **attrs, "timings": timings}
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP rag_stage_duration_ms Duration of each answer stage in milliseconds.",
+            "# TYPE rag_stage_duration_ms histogram",
+        ]
+        with self._lock:
+            for (name, stage), hist in sorted(self.histograms.items()):
+                labels = f'trace="{name}",stage="{stage}"'
+                cumulative = 0
+                for le, count in zip([*map(str, hist.buckets), "+Inf"], hist.counts):
+                    cumulative += count
+                    lines.append(f'rag_stage_duration_ms_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"rag_stage_duration_ms_sum{{{labels}}} {hist.sum}")
+                lines.append(f"rag_stage_duration_ms_count{{{labels}}} {hist.count}")
+
+            for counter in TOKEN_COUNTERS:
+                lines.append(f"# TYPE rag_{counter}_total counter")
+                for (name, key), total in sorted(self.counters.items()):
+                    if key == counter:
+                        lines.append(f'rag_{counter}_total{{trace="{name}"}} {total}')
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9100):
+        """Expose /metrics over HTTP from a daemon thread."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+        print(f"[INFO] Metrics on http://localhost:{port}/metrics")
+        return server
+
+
+tracer = Tracer()
+
+
+# ---------------- Report ----------------
+def report(path: Path, name: str = "answer"):
+    """p50/p95/p99 per stage from a JSONL trace log."""
+    stages = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            trace = json.loads(line)
+            if trace["name"] != name:
+                continue
+            for key, value in trace["timings"].items():
+                if key.endswith("_ms"):
+                    stages.setdefault(key[:-3], []).append(value)
+
+    print(f"{'stage':<18}{'n':>8}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}")
+    for stage, values in sorted(stages.items(), key=lambda kv: -np.median(kv[1])):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{stage:<18}{len(values):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+# ---------------- Entry Point ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from a trace log")
+    parser.add_argument("trace_log", type=Path)
+    parser.add_argument("--name", default="answer")
+    args = parser.parse_args()
+    report(args.trace_log, args.name)
@@ -20,7 +20,8 @@ def json_to_documents(data: dict):
 
 def populate_eval_dataset(eval_dataset, index, metadata, bm25, 
                           model="gpt-4o-mini", k=20, top_k=5, 
-                          weight_dense=0.6, weight_sparse=0.4, rerank=False):
+                          weight_dense=0.6, weight_sparse=0.4, rerank=False,
+                          fusion="weighted", compress=None):
     """
     Fill the 'answer' and 'contexts' fields in the evaluation dataset
     by calling your bot function.
@@ -28,7 +29,7 @@ def populate_eval_dataset(eval_dataset, index, metadata, bm25,
     Args:
         eval_dataset (list ofuti dicts): each dict must have 'question' and optionally 'source'
         index, metadata, bm25: your RAG components
-        model, k, top_k, weight_dense, weight_sparse, rerank: bot settings
+        model, k, top_k, weight_dense, weight_sparse, rerank, fusion, compress: bot settings
 
     Returns:
         list of dicts: same dataset with 'answer' and 'contexts' populated
@@ -51,7 +52,9 @@ def populate_eval_dataset(eval_dataset, index, metadata, bm25,
             top_k=top_k,
             weight_dense=weight_dense,
             weight_sparse=weight_sparse,
-            rerank=rerank
+            rerank=rerank,
+            fusion=fusion,
+            compress=compress
         )
 
         # Save results back into sample
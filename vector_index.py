@@ -0,0 +1,242 @@
+# Libraries
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import faiss
+
+
+INDEX_FILE = "db.index"
+VECTORS_FILE = "db_vectors.npy"
+MANIFEST_FILE = "manifest.json"
+
+# Filtered searches over at most this many vectors scan them exactly instead
+# of running a filtered ANN search
+FILTER_EXACT_MAX = 20000
+
+# Codec used for the stored vectors; "{m}" is the number of PQ sub-quantizers
+STORAGE_CODECS = {
+    "float32": "Flat",
+    "float16": "SQfp16",
+    "int8": "SQ8",
+    "pq": "PQ{m}",
+}
+# Trailing index-factory terms that encode the stored vectors: Flat, SQ8, SQfp16, PQ64, PQ32x4fs, RaBitQ, LSH...
+CODEC_TERM = re.compile(r"^(Flat|SQ\w+|PQ\d+(x\d+)?\w*|RaBitQ\w*|LSH\w*)$")
+
+
+# ---------------- Build ----------------
+def build_index(vectors: np.ndarray, spec: str = "Flat", train_size: int = 50000, seed: int = 0):
+    """
+    Build an inner-product FAISS index from a FAISS index-factory spec
+    (e.g. "Flat", "HNSW32", "IVF1024,Flat", "IVF1024,PQ64").
+
+    Indexes that need training (IVF, PQ) are trained on a random sample of
+    at most `train_size` vectors before all vectors are added.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        n_train = min(train_size, len(vectors))
+        sample = vectors[rng.choice(len(vectors), n_train, replace=False)]
+        print(f"[INFO] Training '{spec}' on {n_train} vectors")
+        index.train(sample)
+
+    index.add(vectors)
+    return index
+
+
+def storage_spec(spec: str, storage: str = "float32", dim: int | None = None, pq_m: int | None = None) -> str:
+    """
+    Swap the vector codec of an index-factory spec for the requested storage,
+    e.g. ("IVF1024,Flat", "int8") -> "IVF1024,SQ8", ("Flat", "pq") -> "PQ384".
+    PQ defaults to one byte per 4 dimensions (16x smaller than float32).
+    """
+    if storage not in STORAGE_CODECS:
+        raise ValueError(f"Unknown storage '{storage}', expected one of {list(STORAGE_CODECS)}")
+    if storage == "float32":
+        return spec
+
+    codec = STORAGE_CODECS[storage].format(m=pq_m or (dim // 4 if dim else 0))
+    parts = [p for p in spec.split(",") if p]
+    # The codec is the last term ("IVF1024,PQ64"); "HNSW32" alone stores flat vectors
+    if parts and CODEC_TERM.match(parts[-1]):
+        parts = parts[:-1]
+    return ",".join(parts + [codec])
+
+
+def set_search_params(index, params: str):
+    """Apply runtime search parameters such as "nprobe=16" or "efSearch=64"."""
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+
+
+# ---------------- Manifest ----------------
+def write_manifest(vector_dir: Path, **fields):
+    now = datetime.now()
+    manifest = {
+        "version": now.strftime("%Y%m%d%H%M%S"),
+        "created_at": now.isoformat(timespec="seconds"),
+        **fields
+    }
+    with open(Path(vector_dir) / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_manifest(vector_dir: Path) -> dict:
+    # Indexes built before the manifest existed are plain IndexFlatIP
+    path = Path(vector_dir) / MANIFEST_FILE
+    if not path.exists():
+        mtime = (Path(vector_dir) / INDEX_FILE).stat().st_mtime
+        return {"index_spec": "Flat", "search_params": "", "version": f"legacy-{int(mtime)}"}
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """Matryoshka truncation: keep the first `dim` components and renormalize."""
+    vectors = np.ascontiguousarray(vectors[:, :dim], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def supports_selector(index) -> bool:
+    # IndexPQ (flat PQ codes) cannot apply an IDSelector during search
+    return not isinstance(index, faiss.IndexPQ)
+
+
+def selector_params(index, ids: np.ndarray):
+    """Search parameters restricting a FAISS search to `ids`, keeping nprobe/efSearch."""
+    sel = faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64))
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=sel)
+
+
+# ---------------- Rescoring ----------------
+def rescore(q: np.ndarray, candidates: np.ndarray, vectors: np.ndarray, k: int):
+    """
+    Exact inner-product rescoring of ANN candidates against full-precision
+    vectors. Returns (D, I) shaped like faiss `search`, padded with -1.
+    """
+    D = np.full((len(q), k), -np.inf, dtype=np.float32)
+    I = np.full((len(q), k), -1, dtype=np.int64)
+
+    for row, (q_row, ids) in enumerate(zip(q, candidates)):
+        ids = np.sort(ids[ids >= 0]) # sorted reads are friendlier to the page cache
+        scores = vectors[ids] @ q_row
+        order = np.argsort(-scores)[:k]
+        D[row, :len(order)] = scores[order]
+        I[row, :len(order)] = ids[order]
+
+    return D, I
+
+
+# ---------------- Load ----------------
+class DenseIndex:
+    """
+    FAISS index together with its manifest. When the index stores compressed
+    codes (float16/int8/PQ) or truncated vectors (search_dim < dim) and the
+    full-precision vectors are available, `search` over-fetches
+    `rescore_factor * k` candidates and rescores them exactly against the
+    memory-mapped vectors. Queries are always full-dimension embeddings.
+    """
+
+    def __init__(self, index, manifest: dict, vectors: np.ndarray | None = None):
+        self.index = index
+        self.manifest = manifest
+        self.vectors = vectors
+        self.rescore_factor = manifest.get("rescore_factor", 1) if vectors is not None else 1
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    @property
+    def version(self) -> str:
+        return self.manifest.get("version", "unversioned")
+
+    def score(self, q: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """
+        Inner products between one query and the given chunk ids, e.g. for
+        candidates found only by BM25. NaN when vectors are not retrievable.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.vectors is not None:
+            return self.vectors[ids] @ q.reshape(-1)
+
+        try:
+            stored = self.index.reconstruct_batch(ids)
+        except RuntimeError: # e.g. IVF without a direct map
+            return np.full(len(ids), np.nan)
+        q_index = truncate(q.reshape(1, -1), self.index.d) if q.size > self.index.d else q.reshape(1, -1)
+        return stored @ q_index.reshape(-1)
+
+    def search(self, q: np.ndarray, k: int, ids: np.ndarray | None = None):
+        """
+        Top-k search, optionally restricted to the chunk ids in `ids`
+        (e.g. one source program). Small filtered subsets are scanned exactly.
+        """
+        if ids is not None and self.vectors is not None and (
+                len(ids) <= FILTER_EXACT_MAX or not supports_selector(self.index)):
+            return rescore(q, np.broadcast_to(ids, (len(q), len(ids))), self.vectors, k)
+        if ids is not None and not supports_selector(self.index):
+            raise ValueError(f"Filtered search on {type(self.index).__name__} needs {VECTORS_FILE}")
+
+        # First stage runs on the truncated prefix when the index is reduced-dimension
+        q_search = truncate(q, self.index.d) if q.shape[1] > self.index.d else q
+        params = selector_params(self.index, ids) if ids is not None else None
+
+        if self.rescore_factor <= 1:
+            return self.index.search(q_search, k, params=params)
+
+        _, candidates = self.index.search(q_search, k * self.rescore_factor, params=params)
+        return rescore(q, candidates, self.vectors, k)
+
+
+def load_vectors(vector_dir: Path, mmap: bool = True) -> np.ndarray | None:
+    path = Path(vector_dir) / VECTORS_FILE
+    if not path.exists():
+        return None
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def read_index(path: Path, mmap: bool = False):
+    """
+    faiss.read_index; with `mmap`, the stored codes (flat storage, IVF lists)
+    are memory-mapped instead of copied, so processes serving the same file
+    share its pages through the page cache. HNSW graphs are still read in.
+    """
+    if mmap and hasattr(faiss, "IO_FLAG_MMAP_IFC") and Path(path).exists():
+        try:
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP_IFC)
+        except RuntimeError as e:
+            print(f"[WARN] Cannot memory-map {path}, reading it into memory: {str(e).splitlines()[0]}")
+    return faiss.read_index(str(path))
+
+
+def load_index(vector_dir: Path, mmap: bool = False) -> DenseIndex:
+    vector_dir = Path(vector_dir)
+    manifest = read_manifest(vector_dir)
+
+    index = read_index(vector_dir / INDEX_FILE, mmap=mmap)
+    set_search_params(index, manifest.get("search_params", ""))
+
+    # Memory-mapped, so pages are only read for rescoring and filtered scans
+    vectors = load_vectors(vector_dir)
+
+    return DenseIndex(index, manifest, vectors)